@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Microbenchmark for the image.bin parser.
+
+Compares tt_flash.hex_image.parse_hex_image against the line by line parser it replaced,
+and checks that both produce the same image. Runs on the image.bin files in a fw package,
+or on a generated image if no package is given.
+
+usage: python scripts/bench_hex_image.py [--fw-tar PATH] [--repeat N]
+"""
+
+from __future__ import annotations
+
+import argparse
+from base64 import b16decode
+import os
+import random
+import sys
+import tarfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tt_flash.hex_image import parse_hex_image
+from tt_flash.image import SparseImage
+
+
+def legacy_parse(image: bytes) -> SparseImage:
+    # The parser from before hex_image.py, kept here as the reference
+    writes = []
+    curr_addr = 0
+    for line in image.decode("utf-8").splitlines():
+        line = line.strip()
+        if line.startswith("@"):
+            curr_addr = int(line.lstrip("@").strip())
+        else:
+            data = b16decode(line)
+            writes.append((curr_addr, data))
+            curr_addr += len(data)
+
+    return SparseImage.from_writes(writes)
+
+
+def generate_image(regions: list[tuple[int, int]], line_size: int = 32) -> bytes:
+    rng = random.Random(0)
+    lines = []
+    for addr, size in regions:
+        lines.append(f"@{addr}")
+        data = rng.getrandbits(8 * size).to_bytes(size, "little")
+        for offset in range(0, size, line_size):
+            lines.append(data[offset : offset + line_size].hex().upper())
+
+    return ("\n".join(lines) + "\n").encode()
+
+
+def load_images(path: str) -> list[tuple[str, bytes]]:
+    images = []
+    with tarfile.open(path) as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith("/image.bin"):
+                images.append((member.name, tar.extractfile(member).read()))
+
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fw-tar", help="fw package to take the images from")
+    parser.add_argument(
+        "--repeat",
+        help="Number of timed runs, the best is reported",
+        default=5,
+        type=int,
+    )
+    args = parser.parse_args()
+
+    if args.fw_tar is not None:
+        images = load_images(args.fw_tar)
+    else:
+        images = [
+            (
+                "generated (WH sized)",
+                generate_image([(0, 0x2000), (0x10000, 0x80000), (0x200000, 0x100000)]),
+            ),
+            ("generated (BH sized)", generate_image([(0, 0x80), (0x10000, 0x48000)])),
+        ]
+
+    for name, raw in images:
+        expected = [(extent.addr, bytes(extent.data)) for extent in legacy_parse(raw)]
+        actual = [(extent.addr, bytes(extent.data)) for extent in parse_hex_image(raw)]
+        assert actual == expected, f"{name}: parsers disagree"
+
+        legacy = min(
+            timeit.repeat(lambda: legacy_parse(raw), number=1, repeat=args.repeat)
+        )
+        new = min(
+            timeit.repeat(lambda: parse_hex_image(raw), number=1, repeat=args.repeat)
+        )
+        print(
+            f"{name}: {len(raw) / 1e6:.1f} MB, legacy {legacy * 1e3:.1f} ms, new {new * 1e3:.1f} ms ({legacy / new:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,191 @@
 # SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
 # SPDX-License-Identifier: Apache-2.0
 
+from __future__ import annotations
+
 import ctypes
+from typing import Callable, Optional
 
 from tt_flash.boot_fs import tt_boot_fs_fd
+from tt_flash.checksum import check_table, fd_cksum, image_cksum
 from tt_flash.error import TTError
+from tt_flash.image import SparseImage, subtract_ranges
 from . import boot_fs
 
 from tt_flash.chip import BhChip
 
 
-def writeback_boardcfg(chip: BhChip, write: bytearray) -> bytearray:
+def writeback_boardcfg(chip: BhChip, write: SparseImage) -> SparseImage:
     # Find boardcfg on chip
-    fd_in_spi = boot_fs.read_tag(
-        lambda addr, size: chip.spi_read(addr, size), "boardcfg"
-    )
+    fd_in_spi = boot_fs.load_table(chip.spi_read).find("boardcfg")
     if fd_in_spi is None:
         raise TTError("Couldn't find boardcfg on chip")
 
     # Find boardcfg in current fd
-    fd_to_flash = boot_fs.read_tag(
-        lambda addr, size: write[addr : addr + size], "boardcfg"
-    )
+    fd_to_flash = boot_fs.load_table(write.read).find("boardcfg")
     if fd_to_flash is None:
         raise TTError("Couldn't find boardcfg in flash package")
     fd_as_data = bytes(fd_in_spi[1])
-    write[fd_to_flash[0] : fd_to_flash[0] + len(fd_as_data)] = fd_as_data
+    write.write(fd_to_flash[0], fd_as_data)
 
-    flashed_fd = boot_fs.read_tag(
-        lambda addr, size: write[addr : addr + size], "boardcfg"
-    )
+    flashed_fd = boot_fs.load_table(write.read).find("boardcfg")
     assert flashed_fd[1] == fd_in_spi[1], f"{flashed_fd[1]} != {fd_in_spi[1]}"
 
     return write
 
 
+def validate_boot_fs_image(boardname_to_display: str, image: SparseImage):
+    """
+    Check the descriptors in a package image against the images they point to, so that a corrupted
+    package is rejected before anything is written.
+
+    Images that aren't part of the package (such as boardcfg, which is kept from the chip) only have their
+    descriptor checked.
+    """
+    layout = boot_fs.load_layout(image.read)
+    if len(layout.primary) == 0:
+        raise TTError(
+            f"Could not find a boot fs table in the image for {boardname_to_display}"
+        )
+
+    def has_data(addr: int, size: int) -> bool:
+        return image.covers(addr, addr + size)
+
+    tables = [layout.primary]
+    if layout.failover is not None:
+        tables.append(boot_fs.BootFsTable(layout.failover[0], [layout.failover]))
+
+    for table in tables:
+        for check in check_table(table, image.read, has_data):
+            if not check.fd_ok:
+                raise TTError(
+                    f"Invalid descriptor for {check.tag} at {check.addr:#x} in the image for {boardname_to_display}; the fd_crc does not match"
+                )
+            if check.data_ok is False:
+                raise TTError(
+                    f"Corrupted {check.tag} image in the image for {boardname_to_display}; the data_crc does not match"
+                )
+
+
+# The primary table and the security binary descriptor live below the failover head
+BOOT_FS_TABLE_REGION = (
+    boot_fs.TT_BOOT_FS_FD_HEAD_ADDR,
+    boot_fs.TT_BOOT_FS_FAILOVER_HEAD_ADDR,
+)
+BOOT_FS_FAILOVER_REGION = (
+    boot_fs.TT_BOOT_FS_FAILOVER_HEAD_ADDR,
+    boot_fs.TT_BOOT_FS_FAILOVER_HEAD_ADDR + ctypes.sizeof(tt_boot_fs_fd),
+)
+
+
+def image_region(fd: tt_boot_fs_fd) -> tuple[int, int]:
+    return fd.spi_addr, fd.spi_addr + fd.flags.f.image_size
+
+
+def spi_image_unchanged(
+    chip: BhChip, spi_fd: Optional[tt_boot_fs_fd], fd: tt_boot_fs_fd
+) -> bool:
+    """
+    @return True if the image that fd describes is already on the SPI, going by its descriptor there and the checksum of its data.
+    """
+    if spi_fd is None or fd_cksum(spi_fd) != spi_fd.fd_crc:
+        return False
+
+    if (
+        spi_fd.spi_addr != fd.spi_addr
+        or spi_fd.flags.f.image_size != fd.flags.f.image_size
+        or spi_fd.data_crc != fd.data_crc
+    ):
+        return False
+
+    # The descriptor matching doesn't mean that the data behind it is intact
+    return image_cksum(chip.spi_read, fd.spi_addr, fd.flags.f.image_size) == fd.data_crc
+
+
+def boot_fs_write_phases(
+    chip: BhChip, write: SparseImage, skip_unchanged: bool = False
+) -> list[SparseImage]:
+    """
+    Split a boot fs image into the parts to write, in the order they must be written.
+
+    The failover image and its descriptor are written first, so that if the flash is interrupted
+    the bootrom still has a complete image to fall back to. Every block is verified as it is written,
+    so the failover is known to be good before anything the primary table uses is touched.
+    The rest of the images follow, and the primary table is written last so it never points at an
+    image that hasn't been written yet.
+
+    @param skip_unchanged leave out the images whose address, size and data_crc match the descriptor with the
+    same tag on the SPI (and whose data on the SPI still has that checksum)
+
+    @return the non-empty phases to write, in order
+    """
+    # A shorter table must not leave stale descriptors from the SPI after its last entry,
+    # and a package without a failover image must not leave the old failover descriptor behind
+    write = write.filled(*BOOT_FS_TABLE_REGION).filled(*BOOT_FS_FAILOVER_REGION)
+    layout = boot_fs.load_layout(write.read)
+    spi_layout = boot_fs.load_layout(chip.spi_read) if skip_unchanged else None
+
+    unchanged = []
+    changed = []
+
+    def is_unchanged(fd: tt_boot_fs_fd, spi_fd: Optional[tt_boot_fs_fd]) -> bool:
+        start, end = image_region(fd)
+        if not write.covers(start, end):
+            # The image isn't part of the package (i.e. boardcfg), only its descriptor is written
+            return False
+
+        if skip_unchanged and spi_image_unchanged(chip, spi_fd, fd):
+            unchanged.append((fd.image_tag_str(), (start, end)))
+            return True
+
+        changed.append(fd.image_tag_str())
+        return False
+
+    failover_images = []
+    if layout.failover is not None:
+        fd = layout.failover[1]
+        spi_fd = None
+        if spi_layout is not None and spi_layout.failover is not None:
+            spi_fd = spi_layout.failover[1]
+        if not is_unchanged(fd, spi_fd):
+            failover_images.append(image_region(fd))
+
+    for _, fd in layout.primary:
+        spi_fd = None
+        if spi_layout is not None:
+            spi_fd = spi_layout.primary.find(fd.image_tag_str())
+        is_unchanged(fd, None if spi_fd is None else spi_fd[1])
+
+    skip = [BOOT_FS_TABLE_REGION, BOOT_FS_FAILOVER_REGION]
+    skip += failover_images
+    skip += [region for _, region in unchanged]
+    images = []
+    for extent in write:
+        images.extend(subtract_ranges(extent.addr, extent.end, skip))
+
+    if skip_unchanged:
+        if len(unchanged) > 0:
+            print(
+                f"\t\t\tSkipping {len(unchanged)} unchanged image(s): {', '.join(tag for tag, _ in unchanged)}"
+            )
+        if len(changed) > 0:
+            print(f"\t\t\tUpdating {len(changed)} image(s): {', '.join(changed)}")
+
+    phases = [
+        write.subset(failover_images),
+        write.subset([BOOT_FS_FAILOVER_REGION]),
+        write.subset(images),
+        write.subset([BOOT_FS_TABLE_REGION]),
+    ]
+    return [phase for phase in phases if len(phase) > 0]
+
+
 TAG_HANDLERS = {"write-boardcfg": writeback_boardcfg}
 
 
-def boot_fs_write(
-    chip: BhChip, boardname_to_display: str, mask: dict, write: bytearray
-) -> bytearray:
+def boot_fs_handlers(
+    boardname_to_display: str, mask: dict
+) -> list[Callable[[BhChip, SparseImage], SparseImage]]:
     param_handlers = []
     for v in mask:
         tag = v.get("tag", None)
@@ -64,7 +209,4 @@ def boot_fs_write(
                     f"Invalid tag {tag} for {boardname_to_display}; there aren't any tags defined!"
                 )
 
-    for handler in param_handlers:
-        write = handler(chip, write)
-
-    return write
+    return param_handlers
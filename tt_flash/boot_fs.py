@@ -1,8 +1,9 @@
 # SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
 # SPDX-License-Identifier: Apache-2.0
 
-from typing import Callable, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import ctypes
+import struct
 
 # Define constants
 TT_BOOT_FS_FD_HEAD_ADDR = 0x0
@@ -121,28 +122,153 @@ class tt_boot_fs_fd(ExtendedStructure):
     def image_tag_str(self):
         output = ""
         for c in self.image_tag:
-            if c == "\0":
+            if c == 0:
                 break
             output += chr(c)
         return output
 
 
+# Layout of tt_boot_fs_fd, used to scan a whole table without building every descriptor
+FD_STRUCT = struct.Struct("<IIIII8sI")
+assert FD_STRUCT.size == ctypes.sizeof(tt_boot_fs_fd)
+FD_FLAGS_INVALID = 1 << 24
+
+
 def read_fd(reader, addr: int) -> tt_boot_fs_fd:
     fd = reader(addr, ctypes.sizeof(tt_boot_fs_fd))
     return tt_boot_fs_fd.from_buffer_copy(fd)
 
 
+class BootFsTable:
+    """
+    The descriptors in a boot fs table, in the order they appear in the table.
+    """
+
+    def __init__(self, addr: int, entries: List[Tuple[int, tt_boot_fs_fd]]):
+        self.addr = addr
+        self.entries = entries
+        self.tags: Dict[str, Tuple[int, tt_boot_fs_fd]] = {}
+        for fd_addr, fd in entries:
+            # If a tag is repeated, the first descriptor is the one that gets used
+            self.tags.setdefault(fd.image_tag_str(), (fd_addr, fd))
+
+    def __iter__(self) -> Iterator[Tuple[int, tt_boot_fs_fd]]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def find(self, tag: str) -> Optional[Tuple[int, tt_boot_fs_fd]]:
+        """
+        @return the address and contents of the descriptor for tag, or None if it isn't in the table.
+        """
+        return self.tags.get(tag, None)
+
+
+def parse_table(data, addr: int = TT_BOOT_FS_FD_HEAD_ADDR) -> BootFsTable:
+    """
+    Parse the descriptors in a boot fs table up to the first invalid descriptor.
+
+    @param data the contents of the table region
+    @param addr the address of the start of the table
+    """
+    data = bytes(data)
+    entries = []
+
+    usable = len(data) - len(data) % FD_STRUCT.size
+    for index, (_, _, flags, _, _, _, _) in enumerate(
+        FD_STRUCT.iter_unpack(data[:usable])
+    ):
+        if flags & FD_FLAGS_INVALID:
+            break
+
+        offset = index * FD_STRUCT.size
+        entries.append((addr + offset, tt_boot_fs_fd.from_buffer_copy(data, offset)))
+
+    return BootFsTable(addr, entries)
+
+
+def load_table(
+    reader: Callable[[int, int], bytes],
+    addr: int = TT_BOOT_FS_FD_HEAD_ADDR,
+    end: int = TT_BOOT_FS_SECURITY_BINARY_FD_ADDR,
+) -> BootFsTable:
+    """
+    Read a boot fs table with a single read and parse it.
+
+    @param reader reads size bytes from addr
+    @param addr the address of the start of the table
+    @param end the address that the table can't extend past
+    """
+    return parse_table(reader(addr, end - addr), addr)
+
+
+def parse_fd(data, addr: int) -> Optional[Tuple[int, tt_boot_fs_fd]]:
+    """
+    Parse a single descriptor, such as the failover head.
+
+    @return the address and contents of the descriptor, or None if it is marked invalid (i.e. erased SPI).
+    """
+    fd = tt_boot_fs_fd.from_buffer_copy(data)
+    if fd.flags.val & FD_FLAGS_INVALID:
+        return None
+    return addr, fd
+
+
+class BootFsLayout:
+    """
+    The descriptors which make up a boot fs.
+
+    The bootrom loads the images in the primary table, if that fails it falls back to the
+    single image described by the failover head.
+    """
+
+    def __init__(
+        self,
+        primary: BootFsTable,
+        security: Optional[Tuple[int, tt_boot_fs_fd]],
+        failover: Optional[Tuple[int, tt_boot_fs_fd]],
+    ):
+        self.primary = primary
+        self.security = security
+        self.failover = failover
+
+
+def load_layout(reader: Callable[[int, int], bytes]) -> BootFsLayout:
+    """
+    Read every boot fs descriptor with a single read.
+
+    @param reader reads size bytes from addr
+    """
+    fd_size = ctypes.sizeof(tt_boot_fs_fd)
+    data = memoryview(
+        reader(TT_BOOT_FS_FD_HEAD_ADDR, TT_BOOT_FS_FAILOVER_HEAD_ADDR + fd_size)
+    )
+
+    def region(addr: int, end: int) -> memoryview:
+        return data[addr - TT_BOOT_FS_FD_HEAD_ADDR : end - TT_BOOT_FS_FD_HEAD_ADDR]
+
+    return BootFsLayout(
+        primary=parse_table(
+            region(TT_BOOT_FS_FD_HEAD_ADDR, TT_BOOT_FS_SECURITY_BINARY_FD_ADDR)
+        ),
+        security=parse_fd(
+            region(
+                TT_BOOT_FS_SECURITY_BINARY_FD_ADDR,
+                TT_BOOT_FS_SECURITY_BINARY_FD_ADDR + fd_size,
+            ),
+            TT_BOOT_FS_SECURITY_BINARY_FD_ADDR,
+        ),
+        failover=parse_fd(
+            region(
+                TT_BOOT_FS_FAILOVER_HEAD_ADDR, TT_BOOT_FS_FAILOVER_HEAD_ADDR + fd_size
+            ),
+            TT_BOOT_FS_FAILOVER_HEAD_ADDR,
+        ),
+    )
+
+
 def read_tag(
     reader: Callable[[int, int], bytes], tag: str
 ) -> Optional[Tuple[int, tt_boot_fs_fd]]:
-    curr_addr = 0
-    while True:
-        fd = read_fd(reader, curr_addr)
-
-        if fd.flags.f.invalid != 0:
-            return None
-
-        if fd.image_tag_str() == tag:
-            return curr_addr, fd
-
-        curr_addr += ctypes.sizeof(tt_boot_fs_fd)
+    return load_table(reader).find(tag)
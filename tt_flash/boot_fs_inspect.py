@@ -0,0 +1,359 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+from typing import Callable, Optional
+
+from tabulate import tabulate
+
+from tt_flash import boot_fs
+from tt_flash.boot_fs import BootFsLayout, tt_boot_fs_fd
+from tt_flash.checksum import fd_cksum
+from tt_flash.chip import BhChip, TTChip, map_chips
+from tt_flash.flash import load_board_image, spi_digest
+from tt_flash.image import SparseImage
+from tt_flash.package import FwPackage
+from tt_flash.utility import CConfig, change_to_public_name, try_get_boardname
+
+
+@dataclass
+class FdInfo:
+    table: str
+    addr: int
+    tag: str
+    spi_addr: int
+    size: int
+    copy_dest: int
+    executable: bool
+    data_crc: int
+    fd_crc: int
+    fd_crc_ok: bool
+
+
+@dataclass
+class BootFsListing:
+    source: str
+    descriptors: list[FdInfo] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def layout_entries(layout: BootFsLayout) -> list[tuple[str, int, tt_boot_fs_fd]]:
+    """
+    @return every descriptor in the layout along with the name of the table it is in.
+    """
+    entries = [("primary", addr, fd) for addr, fd in layout.primary]
+    if layout.security is not None:
+        entries.append(("security", *layout.security))
+    if layout.failover is not None:
+        entries.append(("failover", *layout.failover))
+
+    return entries
+
+
+def list_boot_fs(source: str, reader: Callable[[int, int], bytes]) -> BootFsListing:
+    """
+    List every descriptor of a boot fs, the descriptors are read with a single read.
+
+    @param reader reads from the chip or image to list, i.e. chip.spi_read or SparseImage.read
+    """
+    listing = BootFsListing(source=source)
+    try:
+        for table, addr, fd in layout_entries(boot_fs.load_layout(reader)):
+            listing.descriptors.append(
+                FdInfo(
+                    table=table,
+                    addr=addr,
+                    tag=fd.image_tag_str(),
+                    spi_addr=fd.spi_addr,
+                    size=fd.flags.f.image_size,
+                    copy_dest=fd.copy_dest,
+                    executable=bool(fd.flags.f.executable),
+                    data_crc=fd.data_crc,
+                    fd_crc=fd.fd_crc,
+                    fd_crc_ok=fd_cksum(fd) == fd.fd_crc,
+                )
+            )
+    except Exception as e:
+        listing.error = str(e)
+
+    return listing
+
+
+def chip_source(chip: TTChip) -> tuple[str, Optional[str]]:
+    """
+    @return a description of the chip for the output, and its board name if it was recognized.
+    """
+    boardname = try_get_boardname(chip)
+
+    if boardname is None:
+        return str(chip), None
+    return f"{chip} {{{change_to_public_name(boardname)}}}", boardname
+
+
+def list_chips(devices: list[BhChip]) -> list[BootFsListing]:
+    """
+    @return the boot fs listing of every chip, in the same order as devices
+    """
+    return [list_boot_fs(chip_source(chip)[0], chip.spi_read) for chip in devices]
+
+
+def list_package(fw_package: FwPackage, boardname: str) -> BootFsListing:
+    source = f"{fw_package.path} {{{change_to_public_name(boardname)}}}"
+    try:
+        image, _ = load_board_image(boardname, fw_package)
+    except Exception as e:
+        return BootFsListing(source=source, error=str(e))
+
+    return list_boot_fs(source, image.read)
+
+
+def print_listings(listings: list[BootFsListing], as_json: bool = False):
+    if as_json:
+        print(json.dumps([asdict(listing) for listing in listings], indent=2))
+        return
+
+    headers = [
+        "Table",
+        "FD Addr",
+        "Tag",
+        "SPI Addr",
+        "Size",
+        "Copy Dest",
+        "Exec",
+        "Data CRC",
+        "FD CRC",
+    ]
+    for listing in listings:
+        print(f"{CConfig.COLOR.BLUE}{listing.source}{CConfig.COLOR.ENDC}")
+        if listing.error is not None:
+            print(f"\t{CConfig.COLOR.RED}Error:{CConfig.COLOR.ENDC} {listing.error}")
+            continue
+
+        rows = []
+        for fd in listing.descriptors:
+            if fd.fd_crc_ok:
+                fd_crc = f"{fd.fd_crc:#010x}"
+            else:
+                fd_crc = f"{CConfig.COLOR.RED}{fd.fd_crc:#010x} (invalid){CConfig.COLOR.ENDC}"
+            rows.append(
+                [
+                    fd.table,
+                    f"{fd.addr:#x}",
+                    fd.tag,
+                    f"{fd.spi_addr:#x}",
+                    fd.size,
+                    f"{fd.copy_dest:#x}",
+                    "yes" if fd.executable else "no",
+                    f"{fd.data_crc:#010x}",
+                    fd_crc,
+                ]
+            )
+        print(tabulate(rows, headers=headers))
+        print()
+
+
+@dataclass
+class ImageDiff:
+    table: str
+    tag: str
+    # One of unchanged, changed, added, removed or kept (on the chip but its data isn't part of the package)
+    status: str
+    chip_size: Optional[int]
+    package_size: Optional[int]
+
+    @property
+    def write_bytes(self) -> int:
+        if self.status in ["changed", "added"] and self.package_size is not None:
+            return self.package_size
+        return 0
+
+
+@dataclass
+class ChipBootFsDiff:
+    source: str
+    images: list[ImageDiff] = field(default_factory=list)
+    error: Optional[str] = None
+
+    def count(self, status: str) -> int:
+        return sum(1 for image in self.images if image.status == status)
+
+    @property
+    def write_bytes(self) -> int:
+        return sum(image.write_bytes for image in self.images)
+
+
+def package_digest(image: SparseImage, start: int, end: int) -> str:
+    digest = hashlib.sha256()
+    for extent in image.subset([(start, end)]):
+        digest.update(extent.data)
+
+    return digest.hexdigest()
+
+
+def diff_chip(chip: BhChip, source: str, image: SparseImage) -> ChipBootFsDiff:
+    """
+    Compare the boot fs on a chip against a package image by image tag.
+
+    Both sets of descriptors are read with a single read each. An image whose descriptor matches
+    is then hashed on the chip, a chunk at a time, to catch data which has drifted from its descriptor.
+    """
+    result = ChipBootFsDiff(source=source)
+    try:
+        spi_fds = {
+            (table, fd.image_tag_str()): fd
+            for table, _, fd in layout_entries(boot_fs.load_layout(chip.spi_read))
+        }
+        package_fds = {
+            (table, fd.image_tag_str()): fd
+            for table, _, fd in layout_entries(boot_fs.load_layout(image.read))
+        }
+
+        for key, fd in package_fds.items():
+            spi_fd = spi_fds.get(key, None)
+            start = fd.spi_addr
+            end = start + fd.flags.f.image_size
+
+            if spi_fd is None:
+                status = "added"
+            elif not image.covers(start, end):
+                status = "kept"
+            elif (
+                spi_fd.spi_addr != fd.spi_addr
+                or spi_fd.flags.f.image_size != fd.flags.f.image_size
+                or spi_fd.data_crc != fd.data_crc
+            ):
+                status = "changed"
+            elif spi_digest(chip, [(start, end)]) != package_digest(image, start, end):
+                status = "changed"
+            else:
+                status = "unchanged"
+
+            result.images.append(
+                ImageDiff(
+                    table=key[0],
+                    tag=key[1],
+                    status=status,
+                    chip_size=None if spi_fd is None else spi_fd.flags.f.image_size,
+                    package_size=fd.flags.f.image_size,
+                )
+            )
+
+        for key, spi_fd in spi_fds.items():
+            if key not in package_fds:
+                result.images.append(
+                    ImageDiff(
+                        table=key[0],
+                        tag=key[1],
+                        status="removed",
+                        chip_size=spi_fd.flags.f.image_size,
+                        package_size=None,
+                    )
+                )
+    except Exception as e:
+        result.error = str(e)
+
+    return result
+
+
+def diff_chips(devices: list[BhChip], fw_package: FwPackage) -> list[ChipBootFsDiff]:
+    """
+    Compare the boot fs of every chip against the fw package, see map_chips.
+
+    @return the diff for each chip, in the same order as devices
+    """
+    # The image for each board type is only loaded once
+    images: dict[str, Optional[SparseImage]] = {}
+
+    jobs = []
+    for chip in devices:
+        source, boardname = chip_source(chip)
+        if boardname is None:
+            jobs.append((None, source, None, "Did not recognize the board type"))
+            continue
+
+        if boardname not in images:
+            loaded = load_board_image(boardname, fw_package, skip_missing_fw=True)
+            images[boardname] = None if loaded is None else loaded[0]
+        image = images[boardname]
+        if image is None:
+            jobs.append(
+                (
+                    None,
+                    source,
+                    None,
+                    "Could not find flash data for this board in the fw package",
+                )
+            )
+            continue
+
+        jobs.append((chip, source, image, None))
+
+    def worker(job) -> ChipBootFsDiff:
+        chip, source, image, error = job
+        if error is not None:
+            return ChipBootFsDiff(source=source, error=error)
+        return diff_chip(chip, source, image)
+
+    return map_chips(worker, jobs)
+
+
+def print_diffs(diffs: list[ChipBootFsDiff], as_json: bool = False):
+    if as_json:
+        output = []
+        for diff in diffs:
+            entry = asdict(diff)
+            entry["write_bytes"] = diff.write_bytes
+            output.append(entry)
+        print(json.dumps(output, indent=2))
+        return
+
+    status_colors = {
+        "unchanged": CConfig.COLOR.GREEN,
+        "changed": CConfig.COLOR.YELLOW,
+        "added": CConfig.COLOR.YELLOW,
+        "removed": CConfig.COLOR.RED,
+        "kept": CConfig.COLOR.BLUE,
+    }
+
+    rows = []
+    for diff in diffs:
+        for image in diff.images:
+            rows.append(
+                [
+                    diff.source,
+                    image.table,
+                    image.tag,
+                    f"{status_colors[image.status]}{image.status}{CConfig.COLOR.ENDC}",
+                    image.chip_size,
+                    image.package_size,
+                    image.write_bytes,
+                ]
+            )
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Chip",
+                "Table",
+                "Tag",
+                "Status",
+                "Chip Size",
+                "Package Size",
+                "Write",
+            ],
+            missingval="N/A",
+        )
+    )
+
+    print()
+    for diff in diffs:
+        line = f"{diff.source}: "
+        if diff.error is not None:
+            line += f"{CConfig.COLOR.RED}Error:{CConfig.COLOR.ENDC} {diff.error}"
+        else:
+            line += f"{diff.count('changed')} changed, {diff.count('added')} added, {diff.count('removed')} removed, {diff.write_bytes} bytes to write"
+        print(line)
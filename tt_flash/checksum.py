@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import ctypes
+from dataclasses import dataclass
+import sys
+from typing import Callable, Optional
+
+from tt_flash.boot_fs import BootFsTable, tt_boot_fs_fd
+
+# numpy is optional, without it the words are summed one at a time
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CKSUM_MASK = 0xFFFFFFFF
+# Upper bound on the size of a single read when checksumming the SPI, must be a multiple of 4
+CKSUM_READ_CHUNK_SIZE = 0x100000
+
+
+def boot_fs_cksum(data, cksum: int = 0) -> int:
+    """
+    The checksum used for both the data_crc and the fd_crc of a boot fs descriptor.
+
+    Despite the name this isn't a CRC, the bootrom adds up the data as little endian 32 bit words
+    (wrapping at 2^32). Trailing bytes which don't make up a full word are not included.
+
+    @param data the data to checksum
+    @param cksum the checksum of the preceding data, so a large region can be checksummed a chunk at a time
+    as long as every chunk but the last is a multiple of 4 bytes long
+
+    @return the checksum
+    """
+    data = memoryview(data).cast("B")
+    words = len(data) // 4
+    if words == 0:
+        return cksum
+
+    if np is not None:
+        words_array = np.frombuffer(data, dtype="<u4", count=words)
+        total = int(words_array.sum(dtype=np.uint64))
+    elif sys.byteorder == "little":
+        total = sum(data[: words * 4].cast("I"))
+    else:
+        total = sum(
+            int.from_bytes(data[i : i + 4], "little") for i in range(0, words * 4, 4)
+        )
+
+    return (cksum + total) & CKSUM_MASK
+
+
+def fd_cksum(fd: tt_boot_fs_fd) -> int:
+    """
+    @return the expected fd_crc of a descriptor, which covers every field before the fd_crc itself.
+    """
+    return boot_fs_cksum(bytes(fd)[: ctypes.sizeof(tt_boot_fs_fd) - 4])
+
+
+def image_cksum(
+    reader: Callable[[int, int], bytes],
+    addr: int,
+    size: int,
+    chunk_size: int = CKSUM_READ_CHUNK_SIZE,
+) -> int:
+    """
+    Checksum a region, reading it in bounded chunks.
+
+    @param reader reads size bytes from addr, i.e. chip.spi_read or SparseImage.read
+    """
+    cksum = 0
+    for chunk_start in range(addr, addr + size, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, addr + size)
+        cksum = boot_fs_cksum(reader(chunk_start, chunk_end - chunk_start), cksum)
+
+    return cksum
+
+
+@dataclass
+class FdCheck:
+    tag: str
+    addr: int
+    fd_ok: bool
+    # None when the data wasn't checked
+    data_ok: Optional[bool]
+
+    @property
+    def ok(self) -> bool:
+        return self.fd_ok and self.data_ok is not False
+
+
+def check_table(
+    table: BootFsTable,
+    reader: Callable[[int, int], bytes],
+    has_data: Optional[Callable[[int, int], bool]] = None,
+) -> list[FdCheck]:
+    """
+    Check the fd_crc and data_crc of every descriptor in a table.
+
+    @param reader reads the data that the descriptors point to
+    @param has_data returns False for an (addr, size) region whose data isn't available, its data_crc is not checked
+
+    @return the result for each descriptor, in table order
+    """
+    output = []
+    for addr, fd in table:
+        spi_addr = fd.spi_addr
+        size = fd.flags.f.image_size
+
+        data_ok = None
+        if has_data is None or has_data(spi_addr, size):
+            data_ok = image_cksum(reader, spi_addr, size) == fd.data_crc
+
+        output.append(
+            FdCheck(
+                tag=fd.image_tag_str(),
+                addr=addr,
+                fd_ok=fd_cksum(fd) == fd.fd_crc,
+                data_ok=data_ok,
+            )
+        )
+
+    return output
@@ -4,9 +4,10 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import time
-from typing import Union, Optional
+from typing import Any, Callable, Union, Optional
 import sys
 import yaml
 
@@ -91,6 +92,31 @@ def get_bundle_version_v1(chip: TTChip) -> FwVersion:
     )
 
 
+def map_chips(fn: Callable[[Any], Any], chips: list) -> list:
+    """
+    Run fn for every chip at the same time, with a thread for each chip.
+    Most of the time is spent waiting on the chips, so the threads overlap well despite the GIL.
+
+    @param chips the chips, or a job for each chip
+    @return the result of fn for each chip, in the same order as chips
+    """
+    if len(chips) <= 1:
+        return [fn(chip) for chip in chips]
+
+    with ThreadPoolExecutor(max_workers=len(chips)) as pool:
+        return list(pool.map(fn, chips))
+
+
+def get_bundle_versions(chips: list[TTChip]) -> list[FwVersion]:
+    """
+    Get the bundle version of every chip, see map_chips.
+
+    @return the detected fw bundle version for each chip, in the same order as chips.
+    The versions are cached so later calls to get_bundle_version_unchanged won't message the ARC again.
+    """
+    return map_chips(lambda chip: chip.get_bundle_version_unchanged(), chips)
+
+
 def get_chip_data(chip, file, internal: bool):
     with utility.package_root_path() as path:
         if isinstance(chip, WhChip):
@@ -120,10 +146,12 @@ class TTChip:
         self.fw_defines = init_fw_defines(self)
 
         self.telmetry_cache = None
+        self.bundle_version_cache = None
 
     def reinit(self, callback=None):
         self.luwen_chip = PciChip(self.interface_id)
         self.telmetry_cache = None
+        self.bundle_version_cache = None
 
         chip_count = 0
         block_count = 0
@@ -204,20 +232,36 @@ class TTChip:
     def axi_read32(self, addr: int) -> int:
         return self.luwen_chip.axi_read32(addr)
 
-    def axi_read(self, addr: int, size: int) -> bytes:
+    def axi_read_into(self, addr: int, buffer):
+        """
+        Read len(buffer) bytes starting at addr directly into buffer.
+
+        @param buffer any writable buffer, i.e. a bytearray or a slice of a memoryview
+        """
+        self.luwen_chip.axi_read(addr, buffer)
+
+    def axi_read(self, addr: int, size: int) -> bytearray:
         data = bytearray(size)
-        self.luwen_chip.axi_read(addr, data)
+        self.axi_read_into(addr, data)
 
-        return bytes(data)
+        return data
 
     def spi_write(self, addr: int, data: bytes):
         self.luwen_chip.spi_write(addr, data)
 
-    def spi_read(self, addr: int, size: int) -> bytes:
+    def spi_read_into(self, addr: int, buffer):
+        """
+        Read len(buffer) bytes of the SPI starting at addr directly into buffer.
+
+        @param buffer any writable buffer, i.e. a bytearray or a slice of a memoryview
+        """
+        self.luwen_chip.spi_read(addr, buffer)
+
+    def spi_read(self, addr: int, size: int) -> bytearray:
         data = bytearray(size)
-        self.luwen_chip.spi_read(addr, data)
+        self.spi_read_into(addr, data)
 
-        return bytes(data)
+        return data
 
     def arc_msg(self, *args, **kwargs):
         return self.luwen_chip.arc_msg(*args, **kwargs)
@@ -230,6 +274,26 @@ class TTChip:
     def get_bundle_version(self) -> FwVersion:
         pass
 
+    def get_bundle_version_unchanged(self) -> FwVersion:
+        """
+        Get the bundle version, only messaging the ARC the first time it is requested.
+        The cached version is dropped when the chip is reinitialized or its SPI is rewritten.
+        """
+        if self.bundle_version_cache is None:
+            try:
+                self.arc_msg(
+                    self.fw_defines["MSG_TYPE_ARC_STATE3"],
+                    wait_for_done=True,
+                    timeout=0.1,
+                )
+            except Exception:
+                # Ok to keep going if there's a timeout
+                pass
+
+            self.bundle_version_cache = self.get_bundle_version()
+
+        return self.bundle_version_cache
+
 
 class BhChip(TTChip):
     def min_fw_version(self):
@@ -276,9 +340,12 @@ class GsChip(TTChip):
 
 def detect_local_chips(
     ignore_ethernet: bool = False,
+    quiet: bool = False,
 ) -> list[Union[GsChip, WhChip, BhChip]]:
     """
     This will create a chip which only gaurentees that you have communication with the chip.
+
+    @param quiet don't print the detection progress, for commands whose output is meant to be parsed
     """
 
     chip_count = 0
@@ -295,7 +362,9 @@ def detect_local_chips(
             chip_count -= 1
         chip_count = max(chip_count, 0)
 
-        if sys.stdout.isatty():
+        if quiet:
+            pass
+        elif sys.stdout.isatty():
             did_draw = True
             current_time = time.time()
             if current_time - last_draw > 0.1:
@@ -339,7 +408,7 @@ def detect_local_chips(
         else:
             raise ValueError("Did not recognize board")
 
-    if not did_draw:
+    if not did_draw and not quiet:
         print(f"\tDetected Chips: {chip_count}")
 
     return output
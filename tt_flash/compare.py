@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+# numpy is optional, without it we fall back on comparing the data a chunk at a time
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Granularity of the fallback comparison, chunks which match are skipped without further work
+COMPARE_CHUNK_SIZE = 0x10000
+# Maps every non-zero byte to 1 so that runs of mismatches can be found with a regex
+MISMATCH_TABLE = bytes([0] + [1] * 255)
+MISMATCH_RUN = re.compile(b"\x01+")
+
+
+@dataclass
+class MismatchReport:
+    """
+    Where the data read back from the SPI differs from what we expected to see.
+    All addresses are SPI addresses.
+    """
+
+    count: int = 0
+    first: Optional[int] = None
+    last: Optional[int] = None
+    # [start, end) ranges of consecutive mismatched bytes
+    ranges: list[tuple[int, int]] = field(default_factory=list)
+    # sector address -> number of mismatched bytes in that sector
+    sectors: dict[int, int] = field(default_factory=dict)
+
+    def add_ranges(self, ranges: list[tuple[int, int]], sector_size: int):
+        for start, end in ranges:
+            if len(self.ranges) > 0 and self.ranges[-1][1] == start:
+                self.ranges[-1] = (self.ranges[-1][0], end)
+            else:
+                self.ranges.append((start, end))
+
+            self.count += end - start
+            if self.first is None:
+                self.first = start
+            self.last = end - 1
+
+            sector = start - start % sector_size
+            while sector < end:
+                overlap = min(end, sector + sector_size) - max(start, sector)
+                self.sectors[sector] = self.sectors.get(sector, 0) + overlap
+                sector += sector_size
+
+
+def mismatch_ranges_numpy(expected, actual, addr: int) -> list[tuple[int, int]]:
+    diff = np.flatnonzero(
+        np.frombuffer(expected, dtype=np.uint8) != np.frombuffer(actual, dtype=np.uint8)
+    )
+    if len(diff) == 0:
+        return []
+
+    # Split the mismatched indices into runs of consecutive bytes
+    breaks = np.flatnonzero(np.diff(diff) != 1)
+    starts = np.concatenate(([diff[0]], diff[breaks + 1]))
+    ends = np.concatenate((diff[breaks], [diff[-1]])) + 1
+
+    return [
+        (addr + int(start), addr + int(end))
+        for start, end in zip(starts.tolist(), ends.tolist())
+    ]
+
+
+def mismatch_ranges_chunked(expected, actual, addr: int) -> list[tuple[int, int]]:
+    expected = memoryview(expected).cast("B")
+    actual = memoryview(actual).cast("B")
+
+    ranges = []
+    for chunk_start in range(0, len(expected), COMPARE_CHUNK_SIZE):
+        chunk_end = min(chunk_start + COMPARE_CHUNK_SIZE, len(expected))
+
+        expected_chunk = bytes(expected[chunk_start:chunk_end])
+        actual_chunk = bytes(actual[chunk_start:chunk_end])
+        if expected_chunk == actual_chunk:
+            continue
+
+        # XOR the chunk as one big integer, every byte which differs ends up non-zero.
+        # Mapping those to 1 lets us find the mismatched runs with a single regex scan.
+        diff = (
+            int.from_bytes(expected_chunk, "little")
+            ^ int.from_bytes(actual_chunk, "little")
+        ).to_bytes(len(expected_chunk), "little")
+        for run in MISMATCH_RUN.finditer(diff.translate(MISMATCH_TABLE)):
+            start = addr + chunk_start + run.start()
+            end = addr + chunk_start + run.end()
+            if len(ranges) > 0 and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+
+    return ranges
+
+
+def buffers_equal(a, b) -> bool:
+    # Comparisons against a memoryview unpack it one element at a time unless the left hand
+    # side is a bytearray, in which case both sides are compared with a single memcmp
+    if isinstance(b, bytearray):
+        a, b = b, a
+    if isinstance(a, bytearray) or (isinstance(a, bytes) and isinstance(b, bytes)):
+        return a == b
+
+    return memoryview(a).tobytes() == memoryview(b).tobytes()
+
+
+def compare(
+    expected, actual, addr: int = 0, sector_size: int = 0x1000
+) -> Optional[MismatchReport]:
+    """
+    Compare the data we expected to see on the SPI with what was read back.
+
+    @param expected the data that was written
+    @param actual the data that was read back, must be the same length as expected
+    @param addr the SPI address of the start of the data
+    @param sector_size the granularity of the per sector mismatch counts
+
+    @return None if the data matches, otherwise a report of where it differs
+    """
+    if len(expected) != len(actual):
+        raise ValueError(
+            f"Cannot compare {len(expected)} bytes against {len(actual)} bytes"
+        )
+
+    if buffers_equal(expected, actual):
+        return None
+
+    if np is not None:
+        ranges = mismatch_ranges_numpy(expected, actual, addr)
+    else:
+        ranges = mismatch_ranges_chunked(expected, actual, addr)
+
+    report = MismatchReport()
+    report.add_ranges(ranges, sector_size)
+
+    return report
@@ -3,23 +3,59 @@
 
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from base64 import b16decode
 from datetime import date
 from enum import Enum, auto
+import hashlib
 import json
+from pathlib import Path
 import requests
 import signal
-import tarfile
+import threading
 import time
-from typing import Callable, Optional, Union
+from typing import Callable, Iterator, Optional
 import sys
 
 import tt_flash
-from tt_flash.blackhole import boot_fs_write
-from tt_flash.chip import BhChip, TTChip, GsChip, WhChip, detect_chips
+from tt_flash.blackhole import (
+    BOOT_FS_TABLE_REGION,
+    boot_fs_handlers,
+    boot_fs_write_phases,
+    validate_boot_fs_image,
+)
+from tt_flash.chip import (
+    BhChip,
+    TTChip,
+    GsChip,
+    WhChip,
+    FwVersion,
+    detect_chips,
+    get_bundle_versions,
+)
+from tt_flash.compare import MismatchReport, compare
 from tt_flash.error import TTError
-from tt_flash.utility import change_to_public_name, get_board_type, CConfig
+from tt_flash.hex_image import parse_hex_image
+from tt_flash.image import (
+    Extent,
+    ImagePatch,
+    ImageTemplate,
+    SparseImage,
+    find_param_regions,
+    resolved_param_regions,
+    subtract_ranges,
+)
+from tt_flash.package import FwPackage, load_packed_image
+from tt_flash.record import user_state_dir, write_flash_record
+from tt_flash.staging import ImageStaging
+from tt_flash.status import format_version
+from tt_flash.utility import (
+    change_to_public_name,
+    try_get_boardname,
+    OutputRouter,
+    route_output,
+    CConfig,
+)
 
 from tt_tools_common.reset_common.wh_reset import WHChipReset
 from tt_tools_common.reset_common.bh_reset import BHChipReset
@@ -29,11 +65,9 @@ from tt_tools_common.reset_common.galaxy_reset import GalaxyReset
 def rmw_param(
     chip: TTChip, data: bytearray, spi_addr: int, data_addr: int, len: int
 ) -> bytearray:
-    # Read the existing data
-    existing_data = chip.spi_read(spi_addr, len)
-
-    # Do the RMW
-    data[data_addr : data_addr + len] = existing_data
+    # Read the existing data straight into the image
+    with memoryview(data) as view:
+        chip.spi_read_into(spi_addr, view[data_addr : data_addr + len])
 
     return data
 
@@ -128,6 +162,122 @@ TAG_HANDLERS: dict[str, Callable[[TTChip, bytearray, int, int, int], bytearray]]
     "bundle_version": bundle_version,
 }
 
+# Tags whose value doesn't depend on the chip being flashed
+STATIC_TAGS = ["flash_version", "bundle_version"]
+# Tags whose value says when or by which tt-flash the chip was flashed rather than what fw it has,
+# they are ignored when checking if the SPI already matches the image
+VOLATILE_TAGS = ["incr", "date", "flash_version"]
+# Tags whose handler reads the current value of the parameter from the SPI
+READ_TAGS = ["rmw", "incr"]
+
+# Upper bound on the size of a single SPI read when hashing the SPI
+SPI_READ_CHUNK_SIZE = 0x100000
+
+
+def spi_digest(chip: TTChip, regions: list[tuple[int, int]]) -> str:
+    """
+    @return the SHA-256 of the given SPI regions, read in bounded chunks.
+    """
+    digest = hashlib.sha256()
+    buffer = memoryview(bytearray(SPI_READ_CHUNK_SIZE))
+    for start, end in regions:
+        for chunk_start in range(start, end, SPI_READ_CHUNK_SIZE):
+            chunk = buffer[: min(SPI_READ_CHUNK_SIZE, end - chunk_start)]
+            chip.spi_read_into(chunk_start, chunk)
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def volatile_regions(template: ImageTemplate) -> list[tuple[int, int]]:
+    """
+    @return the regions of the image which don't have to match the SPI for the fw on it to be intact.
+    """
+    return template.ignore_regions
+
+
+def expected_digests(
+    image: SparseImage, ignore: list[tuple[int, int]]
+) -> Iterator[tuple[Extent, list[tuple[int, int]], str]]:
+    """
+    Hash each extent of an image, skipping over the regions that are allowed to differ.
+
+    @param ignore regions of the image that are allowed to differ
+
+    @return (extent, regions that were hashed, SHA-256) for each extent that isn't entirely ignored
+    """
+    for extent in image:
+        regions = subtract_ranges(extent.addr, extent.end, ignore)
+        if len(regions) == 0:
+            continue
+
+        if regions == [(extent.addr, extent.end)] and extent.digest is not None:
+            expected = extent.digest
+        else:
+            digest = hashlib.sha256()
+            data = memoryview(extent.data)
+            for start, end in regions:
+                digest.update(data[start - extent.addr : end - extent.addr])
+            expected = digest.hexdigest()
+
+        yield extent, regions, expected
+
+
+def spi_matches_image(
+    chip: TTChip, image: SparseImage, ignore: list[tuple[int, int]]
+) -> bool:
+    """
+    Check if the SPI already contains the image by comparing the hash of each extent.
+
+    @param ignore regions of the image that are allowed to differ
+
+    @return True if every extent of the image matches the SPI
+    """
+    for _, regions, expected in expected_digests(image, ignore):
+        if spi_digest(chip, regions) != expected:
+            return False
+
+    return True
+
+
+# The smallest unit that the SPI can erase, a write to any part of a sector will rewrite the full sector
+SPI_SECTOR_SIZE = 0x1000
+
+# Stage2 writes and then immediately verifies the image one block at a time,
+# a block which fails verification is rewritten up to SPI_WRITE_RETRIES times
+SPI_WRITE_BLOCK_SIZE = 0x10000
+SPI_WRITE_RETRIES = 3
+
+
+def diff_sectors(
+    current: bytes, write: bytes, addr: int = 0, sector_size: int = SPI_SECTOR_SIZE
+) -> list[tuple[int, int]]:
+    """
+    Find the sectors of an image region which differ from what is currently on the SPI.
+
+    @param current the current contents of the SPI for the region
+    @param write the data that we want to end up on the SPI for the region
+    @param addr the SPI address of the start of the region
+    @param sector_size the granularity of the comparison, sectors are aligned to the SPI address
+
+    @return a list of (start, end) SPI address ranges to write; adjacent sectors are merged into a single range.
+    """
+    ranges = []
+    start = addr
+    while start < addr + len(write):
+        end = min((start // sector_size + 1) * sector_size, addr + len(write))
+        if current[start - addr : end - addr] == write[start - addr : end - addr]:
+            start = end
+            continue
+
+        if len(ranges) > 0 and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+        start = end
+
+    return ranges
+
 
 def live_countdown(wait_time: float, name: str, print_initial: bool = True):
     if print_initial:
@@ -152,11 +302,58 @@ def live_countdown(wait_time: float, name: str, print_initial: bool = True):
         print(f"{name} completed")
 
 
+class SigintGuard:
+    """
+    Ignore Ctrl-C while the SPI is being written.
+
+    Python only delivers signals to the main thread and only allows it to change the handlers,
+    so only the guards taken by the main thread have any effect and they are reference counted.
+    When chips are written from worker threads the main thread holds the guard while it waits for
+    the writes to finish; a Ctrl-C never interrupts a worker, it can only stop the main thread
+    from starting more writes.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.original_handler = None
+
+    @staticmethod
+    def handler(sig, frame):
+        print("Ctrl-C Caught: this process should not be interrupted")
+
+    def __enter__(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        if self.depth == 0:
+            self.original_handler = signal.getsignal(signal.SIGINT)
+            signal.signal(signal.SIGINT, self.handler)
+        self.depth += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        self.depth -= 1
+        if self.depth == 0:
+            signal.signal(signal.SIGINT, self.original_handler)
+            self.original_handler = None
+
+
+__SIGINT_GUARD = SigintGuard()
+
+
+def sigint_guard() -> SigintGuard:
+    return __SIGINT_GUARD
+
+
 @dataclass
 class FlashData:
-    write: bytes
+    write: SparseImage
     name: str
     idname: str
+    # The SPI already contains the image, stage2 only runs the steps that follow the write
+    skip_write: bool = False
 
 
 class FlashStageResultState(Enum):
@@ -173,142 +370,26 @@ class FlashStageResult:
     data: Optional[FlashData]
 
 
-def flash_chip_stage1(
-    chip: TTChip,
-    boardname: str,
-    manifest: Manifest,
-    fw_package: tarfile.TarFile,
-    force: bool,
-    skip_missing_fw: bool = False,
-) -> FlashStageResult:
+def load_board_image(
+    boardname: str, fw_package: FwPackage, skip_missing_fw: bool = False
+) -> Optional[tuple[SparseImage, list]]:
     """
-    Check the chip and determine if it is a candidate to be flashed.
+    Parse the image and param mask for a board type out of the fw package, without filling in any params.
 
-    The possible outcomes for this function are
-    1. The chip is running old fw and can be flashed
-    2. The chip is running fw too old to get the status from
-        a. Force was used, so it will get flashed
-        b. Force was not used, return an error and don't continue the flash process
-    3. The chip is running up to date fw, so we don't flash it
-    4. Force was used so we flash the fw no matter what
+    @return the image and mask for the board, or None if the package has no data for the board and skip_missing_fw was set.
     """
 
-    try:
-        chip.arc_msg(
-            chip.fw_defines["MSG_TYPE_ARC_STATE3"], wait_for_done=True, timeout=0.1
-        )
-    except Exception as err:
-        # Ok to keep going if there's a timeout
-        pass
+    packed = load_packed_image(fw_package, boardname)
+    if packed is not None:
+        return packed
 
-    fw_bundle_version = chip.get_bundle_version()
-
-    if fw_bundle_version.exception is not None:
-        if fw_bundle_version.allow_exception:
-            # Very old gs/wh fw doesn't have support for getting the fw version at all
-            # so it's safe to assume that we need to update
-            if force:
-                print(
-                    f"\t\t\tHit error {fw_bundle_version.exception} while trying to determine running firmware. Falling back to assuming that it needs an update"
-                )
-            else:
-                raise TTError(
-                    f"Hit error {fw_bundle_version.exception} while trying to determine running firmware. If you know what you are doing you may still update by re-rerunning using the --force flag."
-                )
-        else:
-            # BH must always successfully be able to return a fw_version
-            raise TTError(
-                f"Hit error {fw_bundle_version.exception} while trying to determine running firmware."
-            )
-
-    bundle_version = None
-    if fw_bundle_version.running is None:
-        # Certain old fw versions won't have the running_bundle_version populated.
-        # In that case we can just assume that an upgrade is required.
-        if force:
-            print(
-                "\t\t\tLooks like you are running a very old set of fw, assuming that it needs an update"
-            )
-        else:
-            raise TTError(
-                "Looks like you are running a very old set of fw, it's safe to assume that it needs an update but please update it using --force"
-            )
-        print(f"\t\t\tNow flashing tt-flash version: {manifest.bundle_version}")
-    else:
-        component = fw_bundle_version.running[0]
-        if component != manifest.bundle_version[0]:
-            if force:
-                print(
-                    f"\t\t\tFound unexpected bundle version ('{component}'), however you ran with force so we are barreling onwards"
-                )
-            else:
-                raise TTError(
-                    f"Bundle fwId ({manifest.bundle_version[0]}) does not match expected fwId ({component}); {manifest.bundle_version} != {fw_bundle_version.running}"
-                )
-
-        print(
-            f"\t\t\tROM version is: {fw_bundle_version.running}. tt-flash version is: {manifest.bundle_version}"
-        )
-
-    detected_version = True
-    if force:
-        detected_version = False
-        print("\t\t\tForced ROM update requested. ROM will now be updated.")
-    # Best check is for if we have already flashed the desired fw (or newer fw) to spi
-    elif fw_bundle_version.spi is not None:
-        if fw_bundle_version.spi >= manifest.bundle_version:
-            # Now that we know if the SPI is newer we should check to see if the problem is that we have flashed the correct FW, but are running something too old
-            if fw_bundle_version.running is not None:
-                if fw_bundle_version.running >= manifest.bundle_version:
-                    print("\t\t\tROM does not need to be updated.")
-                if fw_bundle_version.running < manifest.bundle_version:
-                    print(
-                        "\t\t\tROM does not need to be updated, while the chip is running old FW the SPI is up to date. You can load the new firmware after a reboot, or in the case of WH a reset. Or skip this check with --force."
-                    )
-            else:
-                print(
-                    "\t\t\tROM does not need to be updated, cannot detect the running FW version but the SPI is ahead of the firmware you are attempting to flash. You can load the newer firmware after a reboot, or in the case of WH a reset. Or skip this check with --force."
-                )
-
-            return FlashStageResult(
-                state=FlashStageResultState.NoFlash, data=None, msg="", can_reset=False
-            )
-    # We did not see any spi versions returned... just go by running
-    elif fw_bundle_version.running is not None:
-        if fw_bundle_version.running >= manifest.bundle_version:
-            print("\t\t\tROM does not need to be updated.")
-            return FlashStageResult(
-                state=FlashStageResultState.NoFlash, data=None, msg="", can_reset=False
-            )
-    else:
-        detected_version = False
-        print(
-            "\t\t\tWas not able to fetch current firmware information, assuming that it needs an update"
-        )
-
-    if detected_version:
-        print("\t\t\tFW bundle version > ROM version. ROM will now be updated.")
-
-    try:
-        image = fw_package.extractfile(f"./{boardname}/image.bin")
-    except KeyError:
-        # If file is not found then key error is raised
-        image = None
-    try:
-        mask = fw_package.extractfile(f"./{boardname}/mask.json")
-    except KeyError:
-        # If file is not found then key error is raised
-        mask = None
+    image = fw_package.read(f"./{boardname}/image.bin")
+    mask = fw_package.read(f"./{boardname}/mask.json")
 
     boardname_to_display = change_to_public_name(boardname)
     if image is None and mask is None:
         if skip_missing_fw:
-            print(
-                f"\t\t\tCould not find flash data for {boardname_to_display} in tarfile"
-            )
-            return FlashStageResult(
-                state=FlashStageResultState.NoFlash, data=None, msg="", can_reset=False
-            )
+            return None
         else:
             raise TTError(
                 f"Could not find flash data for {boardname_to_display} in tarfile"
@@ -323,38 +404,55 @@ def flash_chip_stage1(
         )
 
     # First we verify that the format of mask is valid so we don't partially flash before discovering that the mask is invalid
-    mask = json.loads(mask.read())
+    mask = json.loads(bytes(mask))
 
-    # Now we load the image and start replacing parameters
-    image = image.read()
+    # Now we load the image, the parameters are filled in per chip
+    write = parse_hex_image(bytes(image))
 
-    if isinstance(chip, BhChip):
-        writes = []
+    return write, mask
 
-        curr_addr = 0
-        for line in image.decode("utf-8").splitlines():
-            line = line.strip()
-            if line.startswith("@"):
-                curr_addr = int(line.lstrip("@").strip())
-            else:
-                data = b16decode(line)
-                curr_stop = curr_addr + len(data)
-                if not isinstance(data, bytes):
-                    data = bytes(data)
-                writes.append((curr_addr, data))
 
-                curr_addr = curr_stop
+def load_image_template(
+    chip: TTChip,
+    boardname: str,
+    fw_package: FwPackage,
+    skip_missing_fw: bool = False,
+) -> Optional[ImageTemplate]:
+    """
+    Parse the image and param mask for a board type out of the fw package.
+
+    The result does not depend on the chip (other than its architecture), so it can be shared
+    between every chip with the same board type.
+
+    @return the template for the board, or None if the package has no data for the board and skip_missing_fw was set.
+    """
+    loaded = load_board_image(boardname, fw_package, skip_missing_fw=skip_missing_fw)
+    if loaded is None:
+        return None
 
-        writes.sort(key=lambda x: x[0])
+    write, mask = loaded
+    return build_image_template(chip, boardname, write, mask)
 
-        write = bytearray()
-        last_addr = 0
-        for addr, data in writes:
-            write.extend([0xFF] * (addr - last_addr))
-            write.extend(data)
-            last_addr = addr + len(data)
 
-        write = boot_fs_write(chip, boardname_to_display, mask, write)
+def build_image_template(
+    chip: TTChip, boardname: str, write: SparseImage, mask: list
+) -> ImageTemplate:
+    """
+    Validate the param mask for a board against its image and combine them into a template.
+    """
+    boardname_to_display = change_to_public_name(boardname)
+
+    if isinstance(chip, BhChip):
+        # The whole table region is always written so that no descriptors from a longer table
+        # that is already on the SPI are left behind after the new table, the erased SPI
+        # after the last entry reads as an invalid descriptor and ends the table
+        write = write.filled(*BOOT_FS_TABLE_REGION)
+        validate_boot_fs_image(boardname_to_display, write)
+        return ImageTemplate(
+            image=write,
+            patches=[],
+            image_handlers=boot_fs_handlers(boardname_to_display, mask),
+        )
     else:
         # I expected to see a list of dicts, with the keys
         # "start", "end", "tag"
@@ -374,7 +472,7 @@ def flash_chip_stage1(
                 )
 
             if tag in TAG_HANDLERS:
-                param_handlers.append(((start, end), TAG_HANDLERS[tag]))
+                param_handlers.append(ImagePatch(start, end, tag, TAG_HANDLERS[tag]))
             else:
                 if len(TAG_HANDLERS) > 0:
                     pretty_tags = [f"'{x}'" for x in TAG_HANDLERS.keys()]
@@ -386,45 +484,232 @@ def flash_chip_stage1(
                     raise TTError(
                         f"Invalid tag {tag} for {boardname_to_display}; there aren't any tags defined!"
                     )
-        writes = []
 
-        curr_addr = 0
-        for line in image.decode("utf-8").splitlines():
-            line = line.strip()
-            if line.startswith("@"):
-                curr_addr = int(line.lstrip("@").strip())
+        if all("extent" in v for v in mask):
+            # The mask came from a packed package, which already resolved the extent of every parameter
+            regions = resolved_param_regions(
+                write,
+                [
+                    (patch.start, patch.end, v["extent"])
+                    for patch, v in zip(param_handlers, mask)
+                ],
+                boardname_to_display,
+            )
+        else:
+            # Every parameter is checked against the image before any of them are applied
+            regions = find_param_regions(
+                write,
+                [(patch.start, patch.end) for patch in param_handlers],
+                boardname_to_display,
+            )
+
+        patches = []
+        ignore_regions = []
+        for patch, extent in sorted(
+            zip(param_handlers, regions), key=lambda x: x[0].start
+        ):
+            if extent is None:
+                # The parameter isn't part of the image, so there is nothing to fill in
+                continue
+
+            if patch.tag in VOLATILE_TAGS:
+                ignore_regions.append((patch.start, patch.end))
+
+            if patch.tag in STATIC_TAGS:
+                # These don't depend on the chip, so we can fill them in once for every chip
+                extent.data = patch.handler(
+                    None,
+                    write.writable(extent),
+                    patch.start,
+                    patch.start - extent.addr,
+                    patch.end - patch.start,
+                )
             else:
-                data = b16decode(line)
+                patches.append(patch)
+
+        return ImageTemplate(
+            image=write,
+            patches=patches,
+            image_handlers=[],
+            prefetch=[
+                (patch.start, patch.end) for patch in patches if patch.tag in READ_TAGS
+            ],
+            ignore_regions=ignore_regions,
+        )
 
-                curr_stop = curr_addr + len(data)
 
-                for (start, end), handler in param_handlers:
-                    if start < curr_stop and end > curr_addr:
-                        # chip, data, spi_addr, data_addr, len
-                        if not isinstance(data, bytearray):
-                            data = bytearray(data)
-                        data = handler(
-                            chip, data, start, start - curr_addr, end - start
-                        )
-                    elif start >= curr_addr and start < curr_stop and end >= curr_stop:
-                        raise TTError(
-                            f"A parameter write ({start}:{end}) splits a writeable region ({curr_addr}:{curr_stop}) in {boardname_to_display}! This is not supported."
-                        )
+@dataclass
+class FlashDecision:
+    flash: bool
+    # One of "forced", "outdated", "unknown", "up_to_date", "pending_reset" or "error"
+    reason: str
+    # What should be reported to the user about the decision, in order
+    messages: list[str]
+    # Set when the decision can't be made without force
+    error: Optional[str] = None
+
+
+def decide_flash(
+    fw_bundle_version: FwVersion,
+    bundle_version: tuple[int, int, int, int],
+    force: bool,
+) -> FlashDecision:
+    """
+    Decide if a chip needs to be flashed based on its fw versions alone, nothing is read or printed.
+
+    The possible outcomes for this function are
+    1. The chip is running old fw and can be flashed
+    2. The chip is running fw too old to get the status from
+        a. Force was used, so it will get flashed
+        b. Force was not used, return an error and don't continue the flash process
+    3. The chip is running up to date fw, so we don't flash it
+    4. Force was used so we flash the fw no matter what
+
+    @param fw_bundle_version the versions reported by the chip
+    @param bundle_version the bundle version of the fw package
+    @param force if the chip should be flashed regardless of its version
+    """
+    messages = []
+
+    def error(msg: str) -> FlashDecision:
+        return FlashDecision(flash=False, reason="error", messages=messages, error=msg)
+
+    if fw_bundle_version.exception is not None:
+        if fw_bundle_version.allow_exception:
+            # Very old gs/wh fw doesn't have support for getting the fw version at all
+            # so it's safe to assume that we need to update
+            if force:
+                messages.append(
+                    f"Hit error {fw_bundle_version.exception} while trying to determine running firmware. Falling back to assuming that it needs an update"
+                )
+            else:
+                return error(
+                    f"Hit error {fw_bundle_version.exception} while trying to determine running firmware. If you know what you are doing you may still update by re-rerunning using the --force flag."
+                )
+        else:
+            # BH must always successfully be able to return a fw_version
+            return error(
+                f"Hit error {fw_bundle_version.exception} while trying to determine running firmware."
+            )
 
-                if not isinstance(data, bytes):
-                    data = bytes(data)
-                writes.append((curr_addr, data))
+    if fw_bundle_version.running is None:
+        # Certain old fw versions won't have the running_bundle_version populated.
+        # In that case we can just assume that an upgrade is required.
+        if force:
+            messages.append(
+                "Looks like you are running a very old set of fw, assuming that it needs an update"
+            )
+        else:
+            return error(
+                "Looks like you are running a very old set of fw, it's safe to assume that it needs an update but please update it using --force"
+            )
+        messages.append(f"Now flashing tt-flash version: {bundle_version}")
+    else:
+        component = fw_bundle_version.running[0]
+        if component != bundle_version[0]:
+            if force:
+                messages.append(
+                    f"Found unexpected bundle version ('{component}'), however you ran with force so we are barreling onwards"
+                )
+            else:
+                return error(
+                    f"Bundle fwId ({bundle_version[0]}) does not match expected fwId ({component}); {bundle_version} != {fw_bundle_version.running}"
+                )
 
-                curr_addr = curr_stop
+        messages.append(
+            f"ROM version is: {fw_bundle_version.running}. tt-flash version is: {bundle_version}"
+        )
 
-        writes.sort(key=lambda x: x[0])
+    if force:
+        messages.append("Forced ROM update requested. ROM will now be updated.")
+        return FlashDecision(flash=True, reason="forced", messages=messages)
+    # Best check is for if we have already flashed the desired fw (or newer fw) to spi
+    elif fw_bundle_version.spi is not None:
+        if fw_bundle_version.spi >= bundle_version:
+            # Now that we know if the SPI is newer we should check to see if the problem is that we have flashed the correct FW, but are running something too old
+            reason = "pending_reset"
+            if fw_bundle_version.running is not None:
+                if fw_bundle_version.running >= bundle_version:
+                    reason = "up_to_date"
+                    messages.append("ROM does not need to be updated.")
+                if fw_bundle_version.running < bundle_version:
+                    messages.append(
+                        "ROM does not need to be updated, while the chip is running old FW the SPI is up to date. You can load the new firmware after a reboot, or in the case of WH a reset. Or skip this check with --force."
+                    )
+            else:
+                messages.append(
+                    "ROM does not need to be updated, cannot detect the running FW version but the SPI is ahead of the firmware you are attempting to flash. You can load the newer firmware after a reboot, or in the case of WH a reset. Or skip this check with --force."
+                )
+
+            return FlashDecision(flash=False, reason=reason, messages=messages)
+    # We did not see any spi versions returned... just go by running
+    elif fw_bundle_version.running is not None:
+        if fw_bundle_version.running >= bundle_version:
+            messages.append("ROM does not need to be updated.")
+            return FlashDecision(flash=False, reason="up_to_date", messages=messages)
+    else:
+        messages.append(
+            "Was not able to fetch current firmware information, assuming that it needs an update"
+        )
+        return FlashDecision(flash=True, reason="unknown", messages=messages)
+
+    messages.append("FW bundle version > ROM version. ROM will now be updated.")
+    return FlashDecision(flash=True, reason="outdated", messages=messages)
 
-        write = bytearray()
-        last_addr = 0
-        for addr, data in writes:
-            write.extend([0xFF] * (addr - last_addr))
-            write.extend(data)
-            last_addr = addr + len(data)
+
+def flash_chip_stage1(
+    chip: TTChip,
+    boardname: str,
+    manifest: Manifest,
+    fw_package: FwPackage,
+    force: bool,
+    skip_missing_fw: bool = False,
+    templates: Optional[dict[str, Optional[ImageTemplate]]] = None,
+) -> FlashStageResult:
+    """
+    Check the chip and determine if it is a candidate to be flashed (see decide_flash),
+    if it is then prepare the image to flash to it.
+    """
+
+    decision = decide_flash(
+        chip.get_bundle_version_unchanged(), manifest.bundle_version, force
+    )
+    for message in decision.messages:
+        print(f"\t\t\t{message}")
+    if decision.error is not None:
+        raise TTError(decision.error)
+    if not decision.flash:
+        return FlashStageResult(
+            state=FlashStageResultState.NoFlash, data=None, msg="", can_reset=False
+        )
+
+    boardname_to_display = change_to_public_name(boardname)
+
+    if templates is None:
+        templates = {}
+    if boardname not in templates:
+        templates[boardname] = load_image_template(
+            chip, boardname, fw_package, skip_missing_fw=skip_missing_fw
+        )
+    template = templates[boardname]
+
+    if template is None:
+        print(f"\t\t\tCould not find flash data for {boardname_to_display} in tarfile")
+        return FlashStageResult(
+            state=FlashStageResultState.NoFlash, data=None, msg="", can_reset=False
+        )
+
+    write = template.instantiate(chip)
+
+    # Unless the update was forced there is no point in writing what is already there, but the chip
+    # still goes through the rest of the flash so that the copy to the remote chip and the reset happen
+    skip_write = not force and spi_matches_image(
+        chip, write, volatile_regions(template)
+    )
+    if skip_write:
+        print(
+            "\t\t\tSPI contents already match the fw package, the write will be skipped."
+        )
 
     if boardname in ["NEBULA_X1", "NEBULA_X2"]:
         print(
@@ -456,131 +741,138 @@ def flash_chip_stage1(
         state=FlashStageResultState.Ok,
         can_reset=can_reset,
         msg="",
-        data=FlashData(write=write, name=boardname_to_display, idname=boardname),
+        data=FlashData(
+            write=write,
+            name=boardname_to_display,
+            idname=boardname,
+            skip_write=skip_write,
+        ),
     )
 
 
-def flash_chip_stage2(
-    chip: TTChip,
-    data: FlashData,
-) -> Optional[bool]:
-    # Install sigint handler
-    def signal_handler(sig, frame):
-        print("Ctrl-C Caught: this process should not be interrupted")
-
-    def perform_write(chip, write):
-        original_sigint_handler = signal.getsignal(signal.SIGINT)
-        signal.signal(signal.SIGINT, signal_handler)
-
-        try:
-            chip.spi_write(0, write)
-        finally:
-            signal.signal(signal.SIGINT, original_sigint_handler)
-
-    def perform_verify(chip, write) -> Optional[Union[int, int]]:
-        original_sigint_handler = signal.getsignal(signal.SIGINT)
-        signal.signal(signal.SIGINT, signal_handler)
-
-        try:
-            base_data = chip.spi_read(0, len(write))
-
-            if base_data != write:
-                first_mismatch = None
-                mismatch_count = 0
-                for index, (a, b) in enumerate(zip(base_data, write)):
-                    if a != b:
-                        mismatch_count += 1
-                        if first_mismatch is None:
-                            first_mismatch = index
-                return first_mismatch, mismatch_count
-        finally:
-            signal.signal(signal.SIGINT, original_sigint_handler)
-
-        return None
-
-    if CConfig.is_tty():
-        print(
-            "\t\t\tWriting new firmware... (this may take up to 1 minute)",
-            end="",
-            flush=True,
-        )
-    else:
-        print("\t\t\tWriting new firmware... (this may take up to 1 minute)")
+# Number of mismatched ranges to list before summarizing the rest
+MISMATCH_RANGES_SHOWN = 4
 
-    perform_write(chip, data.write)
 
-    if CConfig.is_tty():
-        print("\r\033[K", end="")
+def print_mismatch_report(report: MismatchReport):
+    print(f"\t\t\t\tFirst Mismatch at: {report.first:#x}")
+    print(f"\t\t\t\tLast Mismatch at: {report.last:#x}")
     print(
-        f"\t\t\tWriting new firmware... {CConfig.COLOR.GREEN}SUCCESS{CConfig.COLOR.ENDC}"
+        f"\t\t\t\tFound {report.count} mismatches in {len(report.ranges)} ranges across {len(report.sectors)} sectors"
     )
 
-    print(
-        "\t\t\tVerifying flashed firmware... (this may also take up to 1 minute)",
-        end="",
-        flush=True,
+    ranges = ", ".join(
+        f"{start:#x}-{end:#x}" for start, end in report.ranges[:MISMATCH_RANGES_SHOWN]
     )
-    if not CConfig.is_tty():
-        print()
+    if len(report.ranges) > MISMATCH_RANGES_SHOWN:
+        ranges += f" and {len(report.ranges) - MISMATCH_RANGES_SHOWN} more"
+    print(f"\t\t\t\tMismatched ranges: {ranges}")
 
-    verify_result = perform_verify(chip, data.write)
-    if verify_result is not None:
-        (first_mismatch, mismatch_count) = verify_result
 
+def flash_chip_stage2(
+    chip: TTChip,
+    data: FlashData,
+    delta: bool = False,
+) -> Optional[bool]:
+    # Every read in this stage is at most one block, so the same few buffers are reused for all of them
+    buffers: dict[int, bytearray] = {}
+
+    def read_block(addr: int, size: int) -> bytearray:
+        buffer = buffers.get(size, None)
+        if buffer is None:
+            buffer = bytearray(size)
+            buffers[size] = buffer
+        chip.spi_read_into(addr, buffer)
+
+        return buffer
+
+    def write_block(addr: int, block: memoryview):
+        if delta:
+            # Only rewrite the sectors which don't already match the image
+            current = read_block(addr, len(block))
+            for start, end in diff_sectors(current, block, addr):
+                chip.spi_write(start, block[start - addr : end - addr])
+        else:
+            chip.spi_write(addr, block)
+
+    def print_progress(message: str):
         if CConfig.is_tty():
-            print(f"\r\033[K", end="")
-        print(
-            f"\t\t\tIntial verification: {CConfig.COLOR.RED}failed{CConfig.COLOR.ENDC}"
-        )
-        print(f"\t\t\t\tFirst Mismatch at: {first_mismatch}")
-        print(f"\t\t\t\tFound {mismatch_count} mismatches")
+            print(f"\r\033[K{message}", end="", flush=True)
+
+    if data.skip_write:
+        print("\t\t\tSPI contents already match the fw package, nothing to write.")
+    else:
+        if isinstance(chip, BhChip):
+            # The boot fs is written in an order that always leaves the chip with something to boot,
+            # with delta the images which haven't changed are left alone
+            phases = boot_fs_write_phases(chip, data.write, skip_unchanged=delta)
+        else:
+            phases = [data.write]
+        blocks = [
+            block for phase in phases for block in phase.blocks(SPI_WRITE_BLOCK_SIZE)
+        ]
+        total_size = sum(len(block) for _, block in blocks)
 
         if CConfig.is_tty():
             print(
-                "\t\t\tAttempted to write firmware one more time... (this, again, may also take up to 1 minute)",
+                "\t\t\tWriting new firmware... (this may take up to 1 minute)",
                 end="",
                 flush=True,
             )
         else:
-            print(
-                "\t\t\tAttempted to write firmware one more time... (this, again, may also take up to 1 minute)"
-            )
+            print("\t\t\tWriting new firmware... (this may take up to 1 minute)")
+
+        # Whatever happens from here on, the cached bundle version no longer describes the SPI
+        chip.bundle_version_cache = None
+
+        # Each block is read back as soon as it's written, so a bad write can be retried on its own
+        written = 0
+        with sigint_guard():
+            for addr, block in blocks:
+                attempt = 0
+                while True:
+                    write_block(addr, block)
+
+                    report = compare(
+                        block,
+                        read_block(addr, len(block)),
+                        addr,
+                        sector_size=SPI_SECTOR_SIZE,
+                    )
+                    if report is None:
+                        break
+
+                    if CConfig.is_tty():
+                        print("\r\033[K", end="")
+                    print(
+                        f"\t\t\tVerification of {addr:#x}-{addr + len(block):#x}: {CConfig.COLOR.RED}failed{CConfig.COLOR.ENDC}"
+                    )
+                    print_mismatch_report(report)
+
+                    attempt += 1
+                    if attempt > SPI_WRITE_RETRIES:
+                        print(
+                            f"\t\t\tVerification {CConfig.COLOR.RED}failed{CConfig.COLOR.ENDC} after {SPI_WRITE_RETRIES} retries, please do not reset or poweroff the board and contact support for further assistance."
+                        )
+                        return None
 
-        perform_write(chip, data.write)
+                    print(
+                        f"\t\t\tRewriting {addr:#x}-{addr + len(block):#x} (attempt {attempt} of {SPI_WRITE_RETRIES})"
+                    )
+
+                written += len(block)
+                print_progress(
+                    f"\t\t\tWriting new firmware... {written * 100 // max(total_size, 1)}%"
+                )
 
         if CConfig.is_tty():
             print("\r\033[K", end="")
         print(
-            f"\t\t\tAttempted to write firmware one more time... {CConfig.COLOR.GREEN}SUCCESS{CConfig.COLOR.ENDC}"
+            f"\t\t\tWriting new firmware... {CConfig.COLOR.GREEN}SUCCESS{CConfig.COLOR.ENDC}"
         )
-
         print(
-            "\t\t\tVerifying second flash attempt... (this may also take up to 1 minute)",
-            end="",
-            flush=True,
+            f"\t\t\tFirmware verification... {CConfig.COLOR.GREEN}SUCCESS{CConfig.COLOR.ENDC}"
         )
-        if not CConfig.is_tty():
-            print()
-
-        verify_result = perform_verify(chip, data.write)
-        if verify_result is not None:
-            (first_mismatch, mismatch_count) = verify_result
-
-            if CConfig.is_tty():
-                print(f"\r\033[K", end="")
-            print(
-                f"\t\t\tSecond verification {CConfig.COLOR.RED}failed{CConfig.COLOR.ENDC}, please do not reset or poweroff the board and contact support for further assistance."
-            )
-
-            print(f"\t\t\t\tFirst Mismatch at: {first_mismatch}")
-            print(f"\t\t\t\tFound {mismatch_count} mismatches")
-            return None
-
-    if CConfig.is_tty():
-        print(f"\r\033[K", end="")
-    print(
-        f"\t\t\tFirmware verification... {CConfig.COLOR.GREEN}SUCCESS{CConfig.COLOR.ENDC}"
-    )
 
     trigged_copy = False
     if data.idname == "NEBULA_X2":
@@ -616,14 +908,142 @@ def flash_chip_stage2(
     return trigged_copy
 
 
+def print_stage2_header(chip: TTChip, data: FlashData):
+    print(
+        f"\t\t{CConfig.COLOR.GREEN}Sub Stage{CConfig.COLOR.ENDC} FLASH Step 2: {CConfig.COLOR.BLUE}{chip} {{{data.name}}}{CConfig.COLOR.ENDC}"
+    )
+
+
+def flash_chip_stage2_captured(
+    router: OutputRouter, chip: TTChip, data: FlashData, delta: bool = False
+) -> tuple[str, Optional[bool]]:
+    """
+    Run stage2 for a chip from a worker thread.
+
+    @return the output of the stage and its result, an exception is treated as a failed flash.
+    """
+    with router.capture() as output:
+        print_stage2_header(chip, data)
+        try:
+            result = flash_chip_stage2(chip, data, delta=delta)
+        except Exception as e:
+            print(
+                f"\t\t\t{CConfig.COLOR.RED}Error:{CConfig.COLOR.ENDC} flash of {chip} failed with - {e}"
+            )
+            result = None
+    return output.getvalue(), result
+
+
+def flash_chips_stage2(
+    flash_data: list[tuple[TTChip, FlashData]], delta: bool = False, jobs: int = 1
+) -> list[Optional[bool]]:
+    """
+    Run stage2 for every chip, with up to jobs chips being written and verified at the same time.
+
+    @return the stage2 result for each chip, in the same order as flash_data.
+    """
+    if jobs <= 1 or len(flash_data) <= 1:
+        results = []
+        for chip, data in flash_data:
+            print_stage2_header(chip, data)
+            results.append(flash_chip_stage2(chip, data, delta=delta))
+        return results
+
+    print(f"\t\tFlashing {len(flash_data)} chips, {jobs} at a time")
+    with sigint_guard(), route_output() as router:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [
+                pool.submit(flash_chip_stage2_captured, router, chip, data, delta)
+                for chip, data in flash_data
+            ]
+
+            # Print each chip's output as a block, in order
+            results = []
+            for future in futures:
+                output, result = future.result()
+                print(output, end="", flush=True)
+                results.append(result)
+
+    return results
+
+
+def flash_chips_pipelined(
+    chips: list[tuple[TTChip, str]],
+    analyze: Callable[[TTChip, str], Optional[FlashData]],
+    delta: bool = False,
+    jobs: int = 1,
+) -> tuple[list[Optional[bool]], int, Optional[BaseException]]:
+    """
+    Run stage1 for each chip in turn, and start stage2 for a chip as soon as its stage1 has finished.
+    The SPI writes for the chips that have already been analysed overlap with the analysis of the rest.
+
+    Chips may already have been written by the time a later chip fails its checks, so a stage1 error
+    only fails that chip. If the analysis is interrupted no more writes are started, but the ones
+    which are in progress are allowed to finish so that the caller can still record them.
+
+    @param analyze runs stage1 for a chip, returns the data to flash or None if the chip should not be flashed
+    @param jobs the number of chips which may be in stage2 at the same time
+
+    @return the stage2 result for each chip that was flashed in the order that they were analysed
+    (None if it failed or was never started), the number of chips which failed stage1,
+    and the exception which interrupted the analysis if there was one.
+    """
+    futures = []
+    printed = 0
+    stage1_failures = 0
+    interrupted = None
+
+    def print_finished(wait: bool):
+        nonlocal printed
+        while printed < len(futures) and (wait or futures[printed].done()):
+            if not futures[printed].cancelled():
+                output, _ = futures[printed].result()
+                print(output, end="", flush=True)
+            printed += 1
+
+    with route_output() as router:
+        pool = ThreadPoolExecutor(max_workers=max(jobs, 1))
+        try:
+            for chip, boardname in chips:
+                try:
+                    data = analyze(chip, boardname)
+                except Exception as e:
+                    print(
+                        f"\t\t\t{CConfig.COLOR.RED}Error:{CConfig.COLOR.ENDC} {chip} will not be flashed - {e}"
+                    )
+                    stage1_failures += 1
+                    data = None
+
+                if data is not None:
+                    futures.append(
+                        pool.submit(
+                            flash_chip_stage2_captured, router, chip, data, delta
+                        )
+                    )
+                print_finished(wait=False)
+        except BaseException as e:
+            # Don't start flashing any more chips
+            interrupted = e
+            for future in futures:
+                future.cancel()
+
+        # The writes which have started must finish, so Ctrl-C is ignored from here on
+        with sigint_guard():
+            pool.shutdown(wait=True)
+            print_finished(wait=True)
+
+    results = [None if future.cancelled() else future.result()[1] for future in futures]
+    return results, stage1_failures, interrupted
+
+
 @dataclass
 class Manifest:
     data: dict
     bundle_version: tuple[int, int, int, int]
 
 
-def verify_package(fw_package: tarfile.TarFile):
-    manifest_data = fw_package.extractfile("./manifest.json")
+def verify_package(fw_package: FwPackage):
+    manifest_data = fw_package.read("./manifest.json")
     if manifest_data is None:
         if CConfig.is_tty():
             # HACK(drosen): Would not have ended the last line with a '\n'
@@ -631,7 +1051,7 @@ def verify_package(fw_package: tarfile.TarFile):
         raise TTError(
             "Could not find manifest in fw package, please check that the correct one was used."
         )
-    manifest = json.loads(manifest_data.read())
+    manifest = json.loads(bytes(manifest_data))
 
     manifest_bundle_version = manifest.get("bundle_version", {})
 
@@ -648,13 +1068,80 @@ def verify_package(fw_package: tarfile.TarFile):
     return Manifest(data=manifest, bundle_version=new_bundle_version)
 
 
+def check_chips(
+    devices: list[TTChip], manifest: Manifest, force: bool = False
+) -> list[dict]:
+    """
+    Run only the version checks from stage1 on every chip, without reading the images from the fw package.
+    The bundle versions of the chips are read in parallel with get_bundle_versions.
+
+    @return a description of each chip which needs to be flashed or couldn't be checked
+    """
+    output = []
+    for chip, fw_bundle_version in zip(devices, get_bundle_versions(devices)):
+        decision = decide_flash(fw_bundle_version, manifest.bundle_version, force)
+        if decision.flash or decision.error is not None:
+            boardname = try_get_boardname(chip)
+
+            output.append(
+                {
+                    "interface_id": chip.interface_id,
+                    "chip": str(chip),
+                    "board": (
+                        None if boardname is None else change_to_public_name(boardname)
+                    ),
+                    "reason": decision.reason,
+                    "running_bundle_version": format_version(fw_bundle_version.running),
+                    "spi_bundle_version": format_version(fw_bundle_version.spi),
+                    "package_bundle_version": format_version(manifest.bundle_version),
+                    "error": decision.error,
+                }
+            )
+
+    return output
+
+
+def record_flash(
+    chip: TTChip,
+    data: FlashData,
+    manifest: Manifest,
+    fw_package: FwPackage,
+    state_dir: Optional[Path] = None,
+):
+    """
+    Write the flash record for a chip that was successfully flashed.
+    Failing to write the record is reported but doesn't fail the flash.
+    """
+    if state_dir is None:
+        state_dir = user_state_dir()
+
+    try:
+        write_flash_record(
+            state_dir,
+            chip,
+            data.idname,
+            data.write,
+            manifest.bundle_version,
+            fw_package.path,
+            fw_package.digest,
+        )
+    except Exception as e:
+        print(
+            f"\t\t{CConfig.COLOR.YELLOW}Warning:{CConfig.COLOR.ENDC} Could not write the flash record for {chip} - {e}"
+        )
+
+
 def flash_chips(
     sys_config: Optional[dict],
     devices: list[TTChip],
-    fw_package: tarfile.TarFile,
+    fw_package: FwPackage,
     force: bool,
     no_reset: bool,
     skip_missing_fw: bool = False,
+    delta: bool = False,
+    jobs: int = 1,
+    pipeline: bool = False,
+    state_dir: Optional[Path] = None,
 ):
     print(f"\t{CConfig.COLOR.GREEN}Sub Stage:{CConfig.COLOR.ENDC} VERIFY")
     if CConfig.is_tty():
@@ -672,15 +1159,13 @@ def flash_chips(
             f"\t\tVerifying fw-package can be flashed: {CConfig.COLOR.GREEN}complete{CConfig.COLOR.ENDC}"
         )
 
+    templates = {}
     to_flash = []
     for dev in devices:
         print(
             f"\t\tVerifying {CConfig.COLOR.BLUE}{dev}{CConfig.COLOR.ENDC} can be flashed"
         )
-        try:
-            boardname = get_board_type(dev.board_type(), from_type=True)
-        except:
-            boardname = None
+        boardname = try_get_boardname(dev)
 
         if boardname is None:
             raise TTError(f"Did not recognize board type for {dev}")
@@ -689,45 +1174,74 @@ def flash_chips(
 
     print(f"\t{CConfig.COLOR.GREEN}Stage:{CConfig.COLOR.ENDC} FLASH")
 
-    flash_data = []
-    flash_error = []
-    needs_reset_wh = []
-    needs_reset_bh = []
-    for chip, boardname in zip(devices, to_flash):
-        print(
-            f"\t\t{CConfig.COLOR.GREEN}Sub Stage{CConfig.COLOR.ENDC} FLASH Step 1: {CConfig.COLOR.BLUE}{chip}{CConfig.COLOR.ENDC}"
-        )
-        result = flash_chip_stage1(
-            chip,
-            boardname,
-            manifest,
-            fw_package,
-            force,
-            skip_missing_fw=skip_missing_fw,
-        )
+    # Query the running fw of every chip up front rather than one at a time in stage1
+    get_bundle_versions(devices)
 
-        if result.state == FlashStageResultState.Err:
-            flash_error.append(f"{chip}: {result.msg}")
-        elif result.state == FlashStageResultState.Ok:
-            flash_data.append((chip, result.data))
-            if result.can_reset:
-                if isinstance(chip, WhChip):
-                    needs_reset_wh.append(chip.interface_id)
-                elif isinstance(chip, BhChip):
-                    needs_reset_bh.append(chip.interface_id)
+    # The prepared images are kept in a temporary file so that memory use doesn't grow with the number of chips
+    with ImageStaging() as staging:
+        flash_data = []
+        flash_error = []
+        needs_reset_wh = []
+        needs_reset_bh = []
 
-    rc = 0
+        def analyze(chip: TTChip, boardname: str) -> Optional[FlashData]:
+            print(
+                f"\t\t{CConfig.COLOR.GREEN}Sub Stage{CConfig.COLOR.ENDC} FLASH Step 1: {CConfig.COLOR.BLUE}{chip}{CConfig.COLOR.ENDC}"
+            )
+            result = flash_chip_stage1(
+                chip,
+                boardname,
+                manifest,
+                fw_package,
+                force,
+                skip_missing_fw=skip_missing_fw,
+                templates=templates,
+            )
 
-    triggered_copy = False
-    for chip, data in flash_data:
-        print(
-            f"\t\t{CConfig.COLOR.GREEN}Sub Stage{CConfig.COLOR.ENDC} FLASH Step 2: {CConfig.COLOR.BLUE}{chip} {{{data.name}}}{CConfig.COLOR.ENDC}"
-        )
-        result = flash_chip_stage2(chip, data)
-        if result is None:
-            rc += 1
+            if result.state == FlashStageResultState.Err:
+                flash_error.append(f"{chip}: {result.msg}")
+            elif result.state == FlashStageResultState.Ok:
+                if result.can_reset:
+                    if isinstance(chip, WhChip):
+                        needs_reset_wh.append(chip.interface_id)
+                    elif isinstance(chip, BhChip):
+                        needs_reset_bh.append(chip.interface_id)
+
+                result.data.write = staging.stage(result.data.write)
+                flash_data.append((chip, result.data))
+                return result.data
+
+            return None
+
+        rc = 0
+        interrupted = None
+        if pipeline:
+            results, rc, interrupted = flash_chips_pipelined(
+                list(zip(devices, to_flash)), analyze, delta=delta, jobs=jobs
+            )
         else:
-            triggered_copy |= result
+            for chip, boardname in zip(devices, to_flash):
+                analyze(chip, boardname)
+
+            # Every image has been staged, so the templates no longer need to be kept in memory
+            templates.clear()
+
+            results = flash_chips_stage2(flash_data, delta=delta, jobs=jobs)
+
+        triggered_copy = False
+        for (chip, data), result in zip(flash_data, results):
+            if result is None:
+                rc += 1
+            else:
+                triggered_copy |= result
+                # A skipped write left the params stamped by the previous flash on the SPI,
+                # so the record of that flash still describes it and the new image would not
+                if not data.skip_write:
+                    record_flash(chip, data, manifest, fw_package, state_dir)
+
+    if interrupted is not None:
+        # The chips which were written have been recorded, don't go on to reset anything
+        raise interrupted
 
     # If we flashed an X2 then we will wait for the copy to complete
     if triggered_copy:
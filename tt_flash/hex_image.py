@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import binascii
+import re
+
+from tt_flash.error import TTError
+from tt_flash.image import SparseImage
+
+# The image format is a list of hex encoded data lines, with lines of the form @<addr>
+# (in decimal) setting the address that the data which follows gets written to.
+ADDRESS_MARKER = re.compile(rb"@[ \t]*([0-9]+)[ \t]*(?:\r?\n|\r?$)")
+
+
+def decode_run(raw: bytes, start: int, end: int) -> bytes:
+    """
+    Decode all of the data lines between two address markers in one go.
+
+    Every line (and every group of digits within a line) must hold a whole number of bytes
+    on its own, otherwise the digits of the following lines would be shifted by half a byte.
+    """
+    lines = raw[start:end].split()
+    if any(len(line) % 2 for line in lines):
+        raise TTError(
+            f"Image data ending at offset {end} has a line with an odd number of hex digits"
+        )
+    digits = b"".join(lines)
+
+    try:
+        return binascii.a2b_hex(digits)
+    except binascii.Error as e:
+        raise TTError(f"Invalid image data ending at offset {end}: {e}")
+
+
+def parse_hex_image(raw: bytes) -> SparseImage:
+    """
+    Parse an image.bin from a fw package.
+
+    This works directly on the raw bytes; every run of data between two address markers
+    is decoded with a single call rather than line by line.
+
+    @param raw the contents of image.bin
+
+    @return the populated regions of the image
+    """
+    writes = []
+
+    curr_addr = 0
+    run_start = 0
+    # Address markers are rare, so searching for them is much cheaper than matching every line
+    marker_start = raw.find(b"@")
+    while marker_start != -1:
+        marker = ADDRESS_MARKER.match(raw, marker_start)
+        if marker is None:
+            raise TTError(f"Invalid address marker at offset {marker_start}")
+
+        writes.append((curr_addr, decode_run(raw, run_start, marker_start)))
+
+        curr_addr = int(marker.group(1))
+        run_start = marker.end()
+        marker_start = raw.find(b"@", run_start)
+    writes.append((curr_addr, decode_run(raw, run_start, len(raw))))
+
+    return SparseImage.from_writes(writes)
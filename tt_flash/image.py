@@ -0,0 +1,500 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from tt_flash.error import TTError
+
+# Value of erased SPI, used to fill the holes between extents
+ERASED_BYTE = 0xFF
+
+
+@dataclass
+class Extent:
+    addr: int
+    data: bytes
+    # SHA-256 of data when it is known ahead of time (i.e. from a packed fw package)
+    digest: Optional[str] = None
+
+    @property
+    def end(self) -> int:
+        return self.addr + len(self.data)
+
+
+class SparseImage:
+    """
+    A firmware image made up of the regions of the SPI that the package actually populates.
+
+    The extents are kept sorted by address and never overlap or touch,
+    regions which are next to each other are merged into a single extent.
+
+    Extent data may be shared with other images (see copy), it is only copied
+    the first time this image writes to it.
+    """
+
+    def __init__(self, extents: Optional[list[Extent]] = None, owned: bool = False):
+        self.extents: list[Extent] = [] if extents is None else extents
+        self.__starts = [extent.addr for extent in self.extents]
+        self.__owned = set(id(extent) for extent in self.extents) if owned else set()
+
+    @classmethod
+    def from_writes(cls, writes: Iterable[tuple[int, bytes]]) -> SparseImage:
+        """
+        Build an image from a list of (addr, data) writes, in any order.
+
+        @param writes the regions of the image
+
+        @return the image, raises a TTError if any of the writes overlap.
+        """
+        writes = sorted(
+            ((addr, data) for addr, data in writes if len(data) > 0),
+            key=lambda x: x[0],
+        )
+
+        extents = []
+        run: list[bytes] = []
+        run_start = 0
+        run_end = 0
+        for addr, data in writes:
+            if len(run) > 0 and addr < run_end:
+                raise TTError(
+                    f"Image region ({addr}:{addr + len(data)}) overlaps with the region ending at {run_end}"
+                )
+
+            if len(run) > 0 and addr == run_end:
+                run.append(data)
+            else:
+                if len(run) > 0:
+                    extents.append(Extent(run_start, bytearray().join(run)))
+                run = [data]
+                run_start = addr
+            run_end = addr + len(data)
+
+        if len(run) > 0:
+            extents.append(Extent(run_start, bytearray().join(run)))
+
+        return cls(extents, owned=True)
+
+    def copy(self) -> SparseImage:
+        """
+        Make a copy of the image which shares the extent data until one of them is written to.
+        """
+        self.__owned.clear()
+        return SparseImage(
+            [Extent(extent.addr, extent.data, extent.digest) for extent in self.extents]
+        )
+
+    def __iter__(self) -> Iterator[Extent]:
+        return iter(self.extents)
+
+    def __len__(self) -> int:
+        return len(self.extents)
+
+    @property
+    def size(self) -> int:
+        """
+        The size of the image if it were laid out contiguously from address 0.
+        """
+        if len(self.extents) == 0:
+            return 0
+        return self.extents[-1].end
+
+    @property
+    def populated_size(self) -> int:
+        """
+        The number of bytes that will actually be written to the SPI.
+        """
+        return sum(len(extent.data) for extent in self.extents)
+
+    def blocks(self, block_size: int) -> Iterator[tuple[int, memoryview]]:
+        """
+        Split the image into (addr, data) blocks which don't cross a multiple of block_size.
+        """
+        for extent in self.extents:
+            data = memoryview(extent.data)
+            start = extent.addr
+            while start < extent.end:
+                end = min((start // block_size + 1) * block_size, extent.end)
+                yield start, data[start - extent.addr : end - extent.addr]
+                start = end
+
+    def find(self, addr: int) -> Optional[Extent]:
+        """
+        @return the extent containing addr, or None if addr lies in a hole.
+        """
+        index = bisect_right(self.__starts, addr) - 1
+        if index < 0:
+            return None
+
+        extent = self.extents[index]
+        if addr < extent.end:
+            return extent
+        return None
+
+    def overlapping(self, start: int, end: int) -> list[Extent]:
+        """
+        @return the extents which overlap the region [start, end).
+        """
+        index = max(bisect_right(self.__starts, start) - 1, 0)
+        output = []
+        for extent in self.extents[index:]:
+            if extent.addr >= end:
+                break
+            if extent.end > start:
+                output.append(extent)
+
+        return output
+
+    def covers(self, start: int, end: int) -> bool:
+        """
+        @return True if every byte of the region [start, end) is populated.
+        """
+        for extent in self.overlapping(start, end):
+            if extent.addr > start:
+                return False
+            start = extent.end
+
+        return start >= end
+
+    def filled(self, start: int, end: int) -> SparseImage:
+        """
+        Make sure that all of [start, end) gets written, the holes in it are filled with erased SPI.
+
+        @return an image with the region populated, the extents outside of it are shared with this image.
+        """
+        if self.covers(start, end):
+            return self
+
+        # Extents which touch the region are merged with it, so the extents still never touch
+        merged = [
+            extent
+            for extent in self.extents
+            if extent.end >= start and extent.addr <= end
+        ]
+        fill_start = min([start] + [extent.addr for extent in merged])
+        fill_end = max([end] + [extent.end for extent in merged])
+
+        data = bytearray([ERASED_BYTE]) * (fill_end - fill_start)
+        for extent in merged:
+            data[extent.addr - fill_start : extent.end - fill_start] = extent.data
+
+        extents = [
+            Extent(extent.addr, extent.data, extent.digest)
+            for extent in self.extents
+            if extent.end < start or extent.addr > end
+        ]
+        extents.append(Extent(fill_start, data))
+        extents.sort(key=lambda extent: extent.addr)
+
+        return SparseImage(extents)
+
+    def subset(self, ranges: Iterable[tuple[int, int]]) -> SparseImage:
+        """
+        @return an image of the parts of this image that lie in ranges, sharing its data.
+        """
+        extents = []
+        for start, end in merge_ranges(ranges):
+            for extent in self.overlapping(start, end):
+                if start <= extent.addr and extent.end <= end:
+                    extents.append(Extent(extent.addr, extent.data, extent.digest))
+                    continue
+
+                sub_start = max(start, extent.addr)
+                sub_end = min(end, extent.end)
+                extents.append(
+                    Extent(
+                        sub_start,
+                        memoryview(extent.data)[
+                            sub_start - extent.addr : sub_end - extent.addr
+                        ],
+                    )
+                )
+
+        return SparseImage(extents)
+
+    def read(self, addr: int, size: int) -> bytes:
+        """
+        Read from the image as if it were contiguous, holes read back as erased SPI.
+        """
+        output = bytearray([ERASED_BYTE]) * size
+        index = max(bisect_right(self.__starts, addr) - 1, 0)
+        for extent in self.extents[index:]:
+            if extent.addr >= addr + size:
+                break
+
+            start = max(extent.addr, addr)
+            end = min(extent.end, addr + size)
+            if start < end:
+                output[start - addr : end - addr] = extent.data[
+                    start - extent.addr : end - extent.addr
+                ]
+
+        return bytes(output)
+
+    def writable(self, extent: Extent) -> bytearray:
+        """
+        Get the data of an extent of this image for modification, copying it first if it may be shared.
+        """
+        if id(extent) not in self.__owned:
+            extent.data = bytearray(extent.data)
+            self.__owned.add(id(extent))
+        extent.digest = None
+
+        return extent.data
+
+    def write(self, addr: int, data: bytes):
+        """
+        Overwrite part of the image; the region must already be populated by a single extent.
+        """
+        extent = self.find(addr)
+        if extent is None or addr + len(data) > extent.end:
+            raise TTError(
+                f"Cannot patch ({addr}:{addr + len(data)}), it is not contained in a single region of the image"
+            )
+
+        self.writable(extent)[
+            addr - extent.addr : addr - extent.addr + len(data)
+        ] = data
+
+    def flatten(self) -> bytearray:
+        """
+        Lay the image out contiguously from address 0, with the holes filled with erased SPI.
+        """
+        output = bytearray([ERASED_BYTE]) * self.size
+        for extent in self.extents:
+            output[extent.addr : extent.end] = extent.data
+
+        return output
+
+
+def subtract_ranges(
+    start: int, end: int, ignore: Iterable[tuple[int, int]]
+) -> list[tuple[int, int]]:
+    """
+    @return the parts of [start, end) which are not covered by any of the ignored ranges.
+    """
+    output = []
+    curr = start
+    for ignore_start, ignore_end in sorted(ignore):
+        if ignore_end <= curr or ignore_start >= end:
+            continue
+        if ignore_start > curr:
+            output.append((curr, ignore_start))
+        curr = max(curr, ignore_end)
+    if curr < end:
+        output.append((curr, end))
+
+    return output
+
+
+def find_param_regions(
+    image: SparseImage, params: list[tuple[int, int]], boardname_to_display: str
+) -> list[Optional[Extent]]:
+    """
+    Find the extents that the parameters from the mask get written into.
+
+    The parameters are sorted once and matched against the extents in a single sweep,
+    every way that a parameter can be misplaced is checked before anything is patched.
+
+    @param params the (start, end) of each parameter
+
+    @return the extent containing each parameter in the same order as params, or None for a parameter
+    which isn't part of the image. Raises a TTError if a parameter is empty, isn't contained in a single
+    extent or overlaps with another parameter.
+    """
+    output: list[Optional[Extent]] = [None] * len(params)
+    order = sorted(range(len(params)), key=lambda i: params[i])
+
+    extents = image.extents
+    index = 0
+    prev_end = None
+    for param in order:
+        start, end = params[param]
+        if end <= start:
+            raise TTError(
+                f"A parameter write ({start}:{end}) in {boardname_to_display} is empty! This is not supported."
+            )
+        if prev_end is not None and start < prev_end:
+            raise TTError(
+                f"A parameter write ({start}:{end}) overlaps with another parameter ending at {prev_end} in {boardname_to_display}! This is not supported."
+            )
+        prev_end = end
+
+        while index < len(extents) and extents[index].end <= start:
+            index += 1
+        if index == len(extents) or extents[index].addr >= end:
+            # The parameter isn't part of the image
+            continue
+
+        extent = extents[index]
+        if start < extent.addr or end > extent.end:
+            raise TTError(
+                f"A parameter write ({start}:{end}) splits a writeable region ({extent.addr}:{extent.end}) in {boardname_to_display}! This is not supported."
+            )
+        output[param] = extent
+
+    return output
+
+
+def resolved_param_regions(
+    image: SparseImage,
+    params: list[tuple[int, int, Optional[int]]],
+    boardname_to_display: str,
+) -> list[Optional[Extent]]:
+    """
+    Look up the extents of parameters which were already matched against the image by find_param_regions
+    when the package was packed.
+
+    @param params the (start, end, extent index) of each parameter, the index is None for a parameter
+    which isn't part of the image
+
+    @return the extent containing each parameter in the same order as params. Raises a TTError if a
+    parameter doesn't lie within the extent it was resolved to.
+    """
+    output: list[Optional[Extent]] = []
+    for start, end, index in params:
+        if index is None:
+            output.append(None)
+            continue
+
+        if not isinstance(index, int) or not 0 <= index < len(image.extents):
+            raise TTError(
+                f"A parameter write ({start}:{end}) in {boardname_to_display} refers to a region that isn't in the image; please repack the fw package"
+            )
+
+        extent = image.extents[index]
+        if end <= start or start < extent.addr or end > extent.end:
+            raise TTError(
+                f"A parameter write ({start}:{end}) in {boardname_to_display} is not inside the region ({extent.addr}:{extent.end}) it was packed with; please repack the fw package"
+            )
+        output.append(extent)
+
+    return output
+
+
+# Regions which are closer together than this are fetched with a single SPI read,
+# it's cheaper to read a few unneeded bytes than to pay for another round trip to the ARC
+SNAPSHOT_MERGE_GAP = 0x1000
+
+
+def merge_ranges(
+    ranges: Iterable[tuple[int, int]], gap: int = 0
+) -> list[tuple[int, int]]:
+    """
+    Merge overlapping ranges, and ranges which are separated by at most gap bytes.
+    """
+    output: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if len(output) > 0 and start <= output[-1][1] + gap:
+            output[-1] = (output[-1][0], max(output[-1][1], end))
+        else:
+            output.append((start, end))
+
+    return output
+
+
+class SpiSnapshot:
+    """
+    Stands in for a chip while the parameters for it are being filled in.
+
+    All of the SPI regions that the parameters read are fetched up front with as few reads as possible,
+    and spi_read is served from that copy. Reads outside of those regions and everything else is passed
+    through to the chip.
+    """
+
+    def __init__(self, chip, ranges: Iterable[tuple[int, int]]):
+        self.chip = chip
+        self.regions = [
+            (start, chip.spi_read(start, end - start))
+            for start, end in merge_ranges(ranges, SNAPSHOT_MERGE_GAP)
+        ]
+        self.__starts = [start for start, _ in self.regions]
+
+    def __lookup(self, addr: int, size: int) -> Optional[memoryview]:
+        index = bisect_right(self.__starts, addr) - 1
+        if index >= 0:
+            start, data = self.regions[index]
+            if addr + size <= start + len(data):
+                return memoryview(data)[addr - start : addr - start + size]
+
+        return None
+
+    def spi_read_into(self, addr: int, buffer):
+        cached = self.__lookup(addr, len(buffer))
+        if cached is None:
+            self.chip.spi_read_into(addr, buffer)
+        else:
+            memoryview(buffer).cast("B")[:] = cached
+
+    def spi_read(self, addr: int, size: int) -> bytearray:
+        data = bytearray(size)
+        self.spi_read_into(addr, data)
+
+        return data
+
+    def __getattr__(self, name: str):
+        return getattr(self.chip, name)
+
+
+# chip, data, spi_addr, data_addr, len
+ParamHandler = Callable[[Any, bytearray, int, int, int], bytearray]
+# chip, image
+ImageHandler = Callable[[Any, SparseImage], SparseImage]
+
+
+@dataclass
+class ImagePatch:
+    start: int
+    end: int
+    tag: str
+    handler: ParamHandler
+
+
+@dataclass
+class ImageTemplate:
+    """
+    The parsed image for a board type, along with the chip specific parameters that still need to be filled in.
+    The template is shared by every chip of the same board type.
+    """
+
+    image: SparseImage
+    # Sorted by address, every patch is contained in a single extent of the image
+    patches: list[ImagePatch]
+    image_handlers: list[ImageHandler]
+    # SPI regions that the patches read from the chip, they are fetched together before any patch is applied
+    prefetch: list[tuple[int, int]] = field(default_factory=list)
+    # Regions that may differ from the SPI without the fw on it being out of date, i.e. the flash date
+    ignore_regions: list[tuple[int, int]] = field(default_factory=list)
+
+    def instantiate(self, chip) -> SparseImage:
+        """
+        Fill in the parameters for a chip; only the regions which get patched are copied.
+        """
+        image = self.image.copy()
+
+        if len(self.prefetch) > 0:
+            chip = SpiSnapshot(chip, self.prefetch)
+
+        # The patches are sorted by address, so they can be matched to the extents in a single sweep
+        extents = iter(image)
+        extent = None
+        for patch in self.patches:
+            while extent is None or extent.end <= patch.start:
+                extent = next(extents)
+
+            extent.data = patch.handler(
+                chip,
+                image.writable(extent),
+                patch.start,
+                patch.start - extent.addr,
+                patch.end - patch.start,
+            )
+
+        for handler in self.image_handlers:
+            image = handler(chip, image)
+
+        return image
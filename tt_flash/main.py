@@ -10,16 +10,25 @@ import datetime
 import os
 import json
 import sys
-import tarfile
 from pathlib import Path
 
 import tt_flash
 from tt_flash import utility
+from tt_flash.boot_fs_inspect import diff_chips, list_chips, list_package
+from tt_flash.boot_fs_inspect import print_diffs, print_listings
 from tt_flash.error import TTError
-from tt_flash.utility import CConfig
-from tt_flash.flash import flash_chips
-
-from .chip import detect_local_chips
+from tt_flash.utility import CConfig, change_to_public_name, try_get_boardname
+from tt_flash.flash import check_chips, flash_chips, verify_package
+from tt_flash.package import FwPackage, pack_package
+from tt_flash.status import get_fleet_status, print_status
+from tt_flash.record import default_state_dirs
+from tt_flash.verify import (
+    print_verify_results,
+    verify_chips,
+    verify_chips_with_records,
+)
+
+from .chip import BhChip, detect_local_chips
 
 # Make version available in --help
 with utility.package_root_path() as path:
@@ -111,6 +120,66 @@ def parse_args():
         default=False,
         action="store_true",
     )
+    flash.add_argument(
+        "--delta",
+        help="Read back the SPI and only write the sectors which differ from the fw package; on Blackhole only the boot fs images which changed are written",
+        default=False,
+        action="store_true",
+    )
+    flash.add_argument(
+        "--jobs",
+        "-j",
+        help="Number of chips to write and verify at the same time",
+        default=1,
+        type=int,
+    )
+    flash.add_argument(
+        "--state-dir",
+        help="Directory to write the flash record for each chip to, defaults to $XDG_STATE_HOME/tt-flash",
+        default=None,
+        type=Path,
+    )
+    flash.add_argument(
+        "--pipeline",
+        help="Flash each chip as soon as it has been checked instead of checking every chip before flashing any of them",
+        default=False,
+        action="store_true",
+    )
+
+    pack = subparsers.add_parser(
+        "pack",
+        help="Convert a fw package into a precompiled package which can be flashed without decoding the images",
+    )
+    pack.add_argument("--fw-tar", help="Path to the firmware tarball", required=True)
+    pack.add_argument(
+        "--output",
+        "-o",
+        help="Path to write the packed firmware tarball to (written uncompressed so that it can be memory mapped)",
+        required=True,
+    )
+
+    check = subparsers.add_parser(
+        "check",
+        help="Check if any chip needs to be flashed with the given fw package without flashing anything.\nExits with 0 if every chip is up to date, otherwise prints the chips which need to be flashed as json and exits with 1.",
+    )
+    check.add_argument("--fw-tar", help="Path to the firmware tarball", required=True)
+    check.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="Check as if the flash would be run with --force",
+    )
+
+    status = subparsers.add_parser(
+        "status",
+        help="Show the running and flashed fw versions of every detected chip without changing anything",
+    )
+    status.add_argument(
+        "--json",
+        help="Print the status as json",
+        default=False,
+        action="store_true",
+    )
 
     verify = subparsers.add_parser(
         "verify",
@@ -124,6 +193,12 @@ def parse_args():
         type=Path,
     )
     config_group.add_argument("--fw-tar", help="Path to the firmware tarball")
+    verify.add_argument(
+        "--state-dir",
+        help="Directory to read the flash records from when no fw package is given",
+        default=None,
+        type=Path,
+    )
     verify.add_argument(
         "--skip-missing-fw",
         help="If the fw packages doesn't contain the fw for a detected board, continue flashing",
@@ -132,6 +207,44 @@ def parse_args():
         required=False,
     )
 
+    bootfs = subparsers.add_parser(
+        "bootfs",
+        help="Inspect the boot fs descriptors of the detected Blackhole chips or of a fw package",
+    )
+    bootfs_commands = bootfs.add_subparsers(
+        title="bootfs command", dest="bootfs_command", required=True
+    )
+    bootfs_show = bootfs_commands.add_parser(
+        "show",
+        help="List every boot fs descriptor of the detected Blackhole chips, or of a board's image in a fw package if --fw-tar is given",
+    )
+    bootfs_show.add_argument(
+        "--fw-tar", help="Path to the firmware tarball to read the image from"
+    )
+    bootfs_show.add_argument(
+        "--board",
+        help="Board to show the image for when reading from a fw package, as named in the package (i.e. P150A-1)",
+    )
+    bootfs_show.add_argument(
+        "--json",
+        help="Print the descriptors as json",
+        default=False,
+        action="store_true",
+    )
+    bootfs_diff = bootfs_commands.add_parser(
+        "diff",
+        help="Compare the boot fs of every detected Blackhole chip against a fw package by image tag and report how much would be written",
+    )
+    bootfs_diff.add_argument(
+        "--fw-tar", help="Path to the firmware tarball", required=True
+    )
+    bootfs_diff.add_argument(
+        "--json",
+        help="Print the differences as json",
+        default=False,
+        action="store_true",
+    )
+
     cmd_args = sys.argv.copy()[1:]
 
     # So... I want to swap to having tt-flash respond to explicit subcommands
@@ -203,14 +316,21 @@ def load_sys_config(path: Optional[Path]) -> Optional[dict]:
         return json.load(open(path))
 
 
-def load_manifest(path: str):
-    tar = tarfile.open(path, "r")
+def check_package_version(version: tuple[int, ...]):
+    if version[0] > 1:
+        raise TTError(
+            f"Unsupported version ({'.'.join(map(str, version))}) this flash program only supports flashing pre 2.0 packages"
+        )
+
+
+def load_manifest(path: str, boardnames: Optional[list[str]] = None):
+    fw_package = FwPackage.load(path, boardnames)
 
-    manifest_data = tar.extractfile("./manifest.json")
+    manifest_data = fw_package.read("./manifest.json")
     if manifest_data is None:
         raise TTError(f"Could not find manifest in {path}")
 
-    manifest = json.loads(manifest_data.read())
+    manifest = json.loads(bytes(manifest_data))
     version = manifest.get("version", None)
     if version is None:
         raise TTError(f"Could not find version in {path}/manifest.json")
@@ -225,7 +345,18 @@ def load_manifest(path: str):
     if int_version is None:
         raise TTError(f"Invalid version ({version}) in {path}/manifest.json")
 
-    return tar, int_version
+    return fw_package, int_version
+
+
+def detected_boardnames(devices: list) -> list[str]:
+    boardnames = []
+    for dev in devices:
+        boardname = try_get_boardname(dev)
+
+        if boardname is not None:
+            boardnames.append(boardname)
+
+    return boardnames
 
 
 def main():
@@ -236,10 +367,8 @@ def main():
 
     if args.command == "flash":
         print(f"{CConfig.COLOR.GREEN}Stage:{CConfig.COLOR.ENDC} SETUP")
-        try:
-            tar, version = load_manifest(args.fw_tar)
-        except Exception as e:
-            print(f"Opening of {args.fw_tar} failed with - {e}\n\n---\n")
+        if not os.path.isfile(args.fw_tar):
+            print(f"Opening of {args.fw_tar} failed with - file not found\n\n---\n")
             parser.print_help()
             sys.exit(1)
 
@@ -248,11 +377,18 @@ def main():
         print(f"{CConfig.COLOR.GREEN}Stage:{CConfig.COLOR.ENDC} DETECT")
         devices = detect_local_chips(ignore_ethernet=True)
 
-        print(f"{CConfig.COLOR.GREEN}Stage:{CConfig.COLOR.ENDC} FLASH")
-        if version[0] > 1:
-            raise TTError(
-                f"Unsupported version ({'.'.join(map(str, version))}) this flash program only supports flashing pre 2.0 packages"
+        # The package is only read once, so we wait until we know which boards we need to keep the images for
+        try:
+            tar, version = load_manifest(
+                args.fw_tar, boardnames=detected_boardnames(devices)
             )
+        except Exception as e:
+            print(f"Opening of {args.fw_tar} failed with - {e}\n\n---\n")
+            parser.print_help()
+            sys.exit(1)
+
+        print(f"{CConfig.COLOR.GREEN}Stage:{CConfig.COLOR.ENDC} FLASH")
+        check_package_version(version)
 
         return flash_chips(
             config,
@@ -261,7 +397,112 @@ def main():
             args.force,
             args.no_reset,
             skip_missing_fw=args.skip_missing_fw,
+            delta=args.delta,
+            jobs=args.jobs,
+            pipeline=args.pipeline,
+            state_dir=args.state_dir,
         )
+    elif args.command == "pack":
+        try:
+            load_manifest(args.fw_tar, boardnames=[])
+        except Exception as e:
+            print(f"Opening of {args.fw_tar} failed with - {e}\n\n---\n")
+            parser.print_help()
+            sys.exit(1)
+
+        for boardname, extent_count, size in pack_package(args.fw_tar, args.output):
+            print(
+                f"\tPacked {CConfig.COLOR.BLUE}{change_to_public_name(boardname)}{CConfig.COLOR.ENDC}: {extent_count} regions, {size} bytes"
+            )
+        print(f"Wrote packed fw package to {args.output}")
+
+        return 0
+    elif args.command == "check":
+        if not os.path.isfile(args.fw_tar):
+            raise TTError(f"Opening of {args.fw_tar} failed with - file not found")
+
+        devices = detect_local_chips(ignore_ethernet=True, quiet=True)
+
+        # Only the manifest is needed, the images for the boards are skipped over
+        fw_package, version = load_manifest(args.fw_tar, boardnames=[])
+        check_package_version(version)
+
+        pending = check_chips(devices, verify_package(fw_package), force=args.force)
+        if len(pending) > 0:
+            print(json.dumps(pending, indent=2))
+            return 1
+
+        return 0
+    elif args.command == "verify":
+        if args.fw_tar is not None and not os.path.isfile(args.fw_tar):
+            raise TTError(f"Opening of {args.fw_tar} failed with - file not found")
+
+        devices = detect_local_chips(ignore_ethernet=True)
+
+        if args.fw_tar is not None:
+            fw_package, version = load_manifest(
+                args.fw_tar, boardnames=detected_boardnames(devices)
+            )
+            check_package_version(version)
+
+            results = verify_chips(
+                devices, fw_package, skip_missing_fw=args.skip_missing_fw
+            )
+        else:
+            # Without a fw package we compare against what was recorded when the chips were last flashed
+            if args.state_dir is not None:
+                state_dirs = [args.state_dir]
+            else:
+                state_dirs = default_state_dirs()
+            results = verify_chips_with_records(devices, state_dirs)
+        print_verify_results(results)
+
+        if all(result.matches for result in results):
+            return 0
+        return 1
+    elif args.command == "status":
+        devices = detect_local_chips(ignore_ethernet=True, quiet=args.json)
+        print_status(get_fleet_status(devices), as_json=args.json)
+
+        return 0
+    elif args.command == "bootfs":
+        if args.fw_tar is not None and not os.path.isfile(args.fw_tar):
+            raise TTError(f"Opening of {args.fw_tar} failed with - file not found")
+
+        def detect_bh_chips() -> list[BhChip]:
+            # Only Blackhole chips have a boot fs, any other chips are ignored
+            devices = detect_local_chips(ignore_ethernet=True, quiet=args.json)
+            devices = [dev for dev in devices if isinstance(dev, BhChip)]
+            if len(devices) == 0:
+                raise TTError("Did not detect any Blackhole chips")
+            return devices
+
+        if args.bootfs_command == "show":
+            if args.fw_tar is not None:
+                if args.board is None:
+                    raise TTError("--board is required when showing a fw package")
+                fw_package, _ = load_manifest(args.fw_tar, boardnames=[args.board])
+                listings = [list_package(fw_package, args.board)]
+            else:
+                listings = list_chips(detect_bh_chips())
+            print_listings(listings, as_json=args.json)
+
+            if any(listing.error is not None for listing in listings):
+                return 1
+            return 0
+        elif args.bootfs_command == "diff":
+            devices = detect_bh_chips()
+            fw_package, _ = load_manifest(
+                args.fw_tar, boardnames=detected_boardnames(devices)
+            )
+            diffs = diff_chips(devices, fw_package)
+            print_diffs(diffs, as_json=args.json)
+
+            if any(diff.error is not None for diff in diffs):
+                return 1
+            return 0
+        else:
+            raise TTError(f"No handler for bootfs command {args.bootfs_command}.")
     else:
         raise TTError(f"No handler for command {args.command}.")
 
@@ -0,0 +1,275 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import posixpath
+import tarfile
+from typing import Iterable, Optional, Union
+
+from tt_flash.error import TTError
+from tt_flash.hex_image import parse_hex_image
+from tt_flash.image import Extent, SparseImage, find_param_regions
+from tt_flash.utility import change_to_public_name
+
+# A packed board directory replaces image.bin with the raw image data and an index describing it
+PACKED_INDEX = "index.json"
+PACKED_IMAGE = "image.raw"
+PACKED_FORMAT = 2
+# Normalized name of the manifest at the top of every fw package
+MANIFEST_NAME = "manifest.json"
+
+
+def normalize_name(name: str) -> str:
+    # Packages are normally built with a leading ./ but we shouldn't depend on it
+    return posixpath.normpath(name)
+
+
+class HashingReader(io.RawIOBase):
+    """
+    Wraps a file that is read front to back, hashing everything that is read from it.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def hexdigest(self) -> str:
+        # The tar reader stops at the end of archive marker, the digest must still cover the whole file
+        while len(self.read(0x100000)) > 0:
+            pass
+        return self.hash.hexdigest()
+
+
+class FwPackage:
+    """
+    The contents of a fw package that are needed to flash the detected boards.
+
+    The archive is read front to back exactly once when the package is loaded; all later lookups
+    are served from the index. Compressed archives are decompressed as a stream (random access into
+    a compressed tarball restarts decompression from the beginning of the file) and only the members
+    for the requested boards are kept in memory. Uncompressed archives are memory mapped instead.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        members: dict[str, Union[bytes, memoryview]],
+        digest: Optional[str] = None,
+    ):
+        self.path = path
+        self.members = members
+        # SHA-256 of the package file, computed while it is read
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path: str, boardnames: Optional[Iterable[str]] = None) -> FwPackage:
+        """
+        @param path the fw package tarball
+        @param boardnames only keep the files for these boards, if None the files for every board are kept.
+        If empty only the manifest is needed, so the archive is read up to the manifest and isn't hashed.
+        """
+        if boardnames is not None:
+            boardnames = set(boardnames)
+        manifest_only = boardnames is not None and len(boardnames) == 0
+
+        def wanted(name: str) -> bool:
+            parts = name.split("/")
+            return boardnames is None or len(parts) == 1 or parts[0] in boardnames
+
+        members: dict[str, Union[bytes, memoryview]] = {}
+        try:
+            tar = tarfile.open(path, "r:")
+        except tarfile.ReadError:
+            tar = None
+
+        if tar is not None:
+            with tar:
+                with open(path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mapped)
+                for member in tar:
+                    name = normalize_name(member.name)
+                    if member.isfile() and wanted(name):
+                        members[name] = view[
+                            member.offset_data : member.offset_data + member.size
+                        ]
+                    if manifest_only and name == MANIFEST_NAME:
+                        break
+                digest = None if manifest_only else hashlib.sha256(view).hexdigest()
+        else:
+            with open(path, "rb") as f:
+                reader = HashingReader(f)
+                with tarfile.open(fileobj=reader, mode="r|*") as tar:
+                    for member in tar:
+                        name = normalize_name(member.name)
+                        if member.isfile() and wanted(name):
+                            data = tar.extractfile(member)
+                            if data is not None:
+                                members[name] = data.read()
+                        if manifest_only and name == MANIFEST_NAME:
+                            break
+                digest = None if manifest_only else reader.hexdigest()
+
+        return cls(path, members, digest=digest)
+
+    def read(self, name: str) -> Optional[Union[bytes, memoryview]]:
+        """
+        @return the contents of a file in the package, or None if it isn't in the package.
+        """
+        return self.members.get(normalize_name(name), None)
+
+
+def load_packed_image(
+    fw_package: FwPackage, boardname: str
+) -> Optional[tuple[SparseImage, list]]:
+    """
+    Load the image for a board from a package created by pack_package.
+
+    @return the image and the mask for the board, or None if the board has not been packed.
+    Each region param in the mask carries the index of the extent that it falls in.
+    """
+    index = fw_package.read(f"./{boardname}/{PACKED_INDEX}")
+    if index is None:
+        return None
+    index = json.loads(bytes(index))
+
+    if index.get("format", None) != PACKED_FORMAT:
+        raise TTError(
+            f"Unsupported packed image format ({index.get('format', None)}) for {change_to_public_name(boardname)}; please repack the fw package with this version of tt-flash"
+        )
+
+    raw = fw_package.read(f"./{boardname}/{PACKED_IMAGE}")
+    if raw is None:
+        raise TTError(
+            f"Could not find packed image for {change_to_public_name(boardname)} in tarfile; expected to see {boardname}/{PACKED_IMAGE}"
+        )
+
+    extents = []
+    for entry in index["extents"]:
+        offset = entry["offset"]
+        extents.append(
+            Extent(
+                entry["addr"],
+                raw[offset : offset + entry["size"]],
+                digest=entry["sha256"],
+            )
+        )
+
+    return SparseImage(extents), index["patches"]
+
+
+def pack_board(boardname: str, image: bytes, mask: bytes) -> tuple[bytes, bytes]:
+    """
+    Convert the image.bin and mask.json for a board into the packed format.
+
+    @return the contents of the index and the raw image
+    """
+    boardname_to_display = change_to_public_name(boardname)
+
+    write = parse_hex_image(image)
+    patches = json.loads(mask)
+
+    # The region params are checked up front so that a bad mask fails at pack time rather than flash time
+    params = []
+    for patch in patches:
+        start = patch.get("start", None)
+        end = patch.get("end", None)
+        if isinstance(start, int) and isinstance(end, int):
+            params.append((start, end))
+    regions = find_param_regions(write, params, boardname_to_display)
+
+    # Each region param is stored with the index of the extent it falls in, so the
+    # search doesn't have to be repeated when the package is loaded
+    if len(params) == len(patches):
+        extent_indices = {id(extent): index for index, extent in enumerate(write)}
+        patches = [
+            {**patch, "extent": None if extent is None else extent_indices[id(extent)]}
+            for patch, extent in zip(patches, regions)
+        ]
+
+    raw = bytearray()
+    extents = []
+    for extent in write:
+        extents.append(
+            {
+                "addr": extent.addr,
+                "offset": len(raw),
+                "size": len(extent.data),
+                "sha256": hashlib.sha256(extent.data).hexdigest(),
+            }
+        )
+        raw.extend(extent.data)
+
+    index = {"format": PACKED_FORMAT, "extents": extents, "patches": patches}
+
+    return json.dumps(index, indent=2).encode(), bytes(raw)
+
+
+def pack_package(src: str, dst: str) -> list[tuple[str, int, int]]:
+    """
+    Convert a fw package into one that can be loaded without decoding.
+
+    Every board image.bin is replaced with the raw image data, an index of its extents with their
+    SHA-256 and the patch table from mask.json, with the extent of each region param resolved. The output is an uncompressed tarball so that
+    the images can be memory mapped when flashing.
+
+    @return (boardname, extent count, image size) for each board that was packed
+    """
+    boards: dict[str, dict[str, tuple[tarfile.TarInfo, bytes]]] = {}
+    with tarfile.open(src, "r|*") as tar_in, tarfile.open(dst, "w") as tar_out:
+        for member in tar_in:
+            data = None
+            if member.isfile():
+                fileobj = tar_in.extractfile(member)
+                if fileobj is not None:
+                    data = fileobj.read()
+
+            dirname, filename = os.path.split(member.name)
+            if filename in ["image.bin", "mask.json"] and data is not None:
+                boards.setdefault(dirname, {})[filename] = (member, data)
+                if filename == "image.bin":
+                    continue
+
+            tar_out.addfile(member, io.BytesIO(data) if data is not None else None)
+
+        packed = []
+        for dirname, files in boards.items():
+            boardname = os.path.basename(dirname)
+            if "image.bin" not in files or "mask.json" not in files:
+                raise TTError(
+                    f"Could not pack {change_to_public_name(boardname)}; expected to see both {boardname}/image.bin and {boardname}/mask.json"
+                )
+
+            member, image = files["image.bin"]
+            _, mask = files["mask.json"]
+            index, raw = pack_board(boardname, image, mask)
+
+            for filename, data in [(PACKED_INDEX, index), (PACKED_IMAGE, raw)]:
+                info = tarfile.TarInfo(f"{dirname}/{filename}")
+                info.size = len(data)
+                info.mtime = member.mtime
+                info.mode = member.mode
+                tar_out.addfile(info, io.BytesIO(data))
+
+            packed.append((boardname, len(json.loads(index)["extents"]), len(raw)))
+
+    return packed
@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+from typing import Optional
+
+import tt_flash
+from tt_flash.chip import TTChip
+from tt_flash.error import TTError
+from tt_flash.image import SparseImage
+
+RECORD_FORMAT = 1
+
+# Flash records are written to the user state dir unless a state dir is given,
+# when verifying without a state dir both locations are searched
+SYSTEM_STATE_DIR = Path("/var/lib/tenstorrent/tt-flash")
+
+
+def user_state_dir() -> Path:
+    state_home = os.environ.get("XDG_STATE_HOME", None)
+    if state_home:
+        return Path(state_home).joinpath("tt-flash")
+    return Path("~/.local/state/tt-flash").expanduser()
+
+
+def default_state_dirs() -> list[Path]:
+    return [user_state_dir(), SYSTEM_STATE_DIR]
+
+
+def board_key(chip: TTChip) -> str:
+    """
+    @return an identifier for the board that doesn't change when the chip is moved to a different slot.
+    """
+    return f"{chip.get_telemetry_unchanged().board_id:016x}"
+
+
+def record_path(state_dir: Path, key: str) -> Path:
+    return state_dir.joinpath(f"{key}.json")
+
+
+def write_flash_record(
+    state_dir: Path,
+    chip: TTChip,
+    boardname: str,
+    image: SparseImage,
+    bundle_version: tuple[int, int, int, int],
+    package_path: str,
+    package_digest: Optional[str],
+) -> Path:
+    """
+    Record what was just flashed to a chip, so that the SPI can later be verified without the fw package.
+
+    @param image exactly what was written to the SPI
+
+    @return the path of the record
+    """
+    key = board_key(chip)
+    record = {
+        "format": RECORD_FORMAT,
+        "board_id": key,
+        "boardname": boardname,
+        "interface_id": chip.interface_id,
+        "bundle_version": ".".join(str(x) for x in bundle_version),
+        "package": {
+            "path": os.path.abspath(package_path),
+            "sha256": package_digest,
+        },
+        "tt_flash_version": tt_flash.__version__,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "extents": [
+            {
+                "addr": extent.addr,
+                "size": len(extent.data),
+                "sha256": (
+                    extent.digest
+                    if extent.digest is not None
+                    else hashlib.sha256(extent.data).hexdigest()
+                ),
+            }
+            for extent in image
+        ],
+    }
+
+    # Write to a temporary file first so that an interrupted flash never leaves a partial record behind
+    state_dir.mkdir(parents=True, exist_ok=True)
+    path = record_path(state_dir, key)
+    fd, tmp_path = tempfile.mkstemp(dir=state_dir, prefix=f".{key}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return path
+
+
+def find_flash_record(chip: TTChip, state_dirs: list[Path]) -> tuple[Path, dict]:
+    """
+    Find the most recent flash record for a chip.
+
+    @return the path of the record and its contents, raises a TTError if there is no record for the chip.
+    """
+    key = board_key(chip)
+
+    found = []
+    for state_dir in state_dirs:
+        path = record_path(state_dir, key)
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            raise TTError(f"Could not read flash record {path}: {e}")
+
+        if record.get("format", None) != RECORD_FORMAT:
+            raise TTError(
+                f"Unsupported flash record format ({record.get('format', None)}) in {path}"
+            )
+        found.append((path, record))
+
+    if len(found) == 0:
+        searched = ", ".join(str(state_dir) for state_dir in state_dirs)
+        raise TTError(f"Could not find a flash record for board {key} in {searched}")
+
+    return max(found, key=lambda x: x[1]["timestamp"])
@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import tempfile
+from typing import Optional
+
+from tt_flash.image import Extent, SparseImage
+
+
+class ImageStaging:
+    """
+    Holds the prepared images for every chip in a temporary file rather than in memory.
+
+    Each extent is written to the file once and the staged image gets a read only memory mapped view of it,
+    so the OS is free to page the data in and out while the chips are being flashed. Extents with the same
+    contents (i.e. every extent that wasn't patched for a specific chip) are stored once and shared.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.staged: dict[str, memoryview] = {}
+        self.mappings: list[mmap.mmap] = []
+
+    def __enter__(self) -> ImageStaging:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # The views handed out must be released before the mappings can be closed,
+        # any that are still in use will be cleaned up when they are garbage collected
+        self.staged.clear()
+        for mapping in self.mappings:
+            try:
+                mapping.close()
+            except BufferError:
+                pass
+        self.mappings.clear()
+        self.file.close()
+
+    def stage_data(self, data, digest: Optional[str] = None) -> memoryview:
+        """
+        @return a read only view of a copy of data stored in the staging file.
+        """
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+
+        view = self.staged.get(digest, None)
+        if view is not None:
+            return view
+
+        # Mappings must start on an allocation boundary, so every extent is padded out to one
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.flush()
+
+        size = len(data)
+        self.size = -(-(offset + size) // mmap.ALLOCATIONGRANULARITY) * (
+            mmap.ALLOCATIONGRANULARITY
+        )
+
+        if size == 0:
+            view = memoryview(b"")
+        else:
+            mapping = mmap.mmap(
+                self.file.fileno(), size, offset=offset, access=mmap.ACCESS_READ
+            )
+            self.mappings.append(mapping)
+            view = memoryview(mapping)
+        self.staged[digest] = view
+
+        return view
+
+    def stage(self, image: SparseImage) -> SparseImage:
+        """
+        Move the data of an image into the staging file.
+
+        @return an image with the same contents whose extents are backed by the staging file and have their digest filled in
+        """
+        extents = []
+        for extent in image:
+            digest = extent.digest
+            if digest is None:
+                digest = hashlib.sha256(extent.data).hexdigest()
+            extents.append(
+                Extent(extent.addr, self.stage_data(extent.data, digest), digest)
+            )
+
+        return SparseImage(extents)
@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass
+import json
+from typing import Optional
+
+from tabulate import tabulate
+
+from tt_flash.chip import TTChip, map_chips
+from tt_flash.utility import change_to_public_name, try_get_boardname
+
+
+def format_version(version: Optional[tuple[int, int, int, int]]) -> Optional[str]:
+    if version is None:
+        return None
+    return ".".join(str(x) for x in version)
+
+
+@dataclass
+class ChipStatus:
+    interface_id: int
+    chip: str
+    board: Optional[str]
+    running_bundle_version: Optional[str]
+    spi_bundle_version: Optional[str]
+    m3_app_fw_version: Optional[str]
+    arc_fw_version: Optional[str]
+    smbus_fw_version: Optional[str]
+    error: Optional[str]
+
+
+def get_chip_status(chip: TTChip) -> ChipStatus:
+    """
+    Read the fw versions of a chip without changing anything on it.
+    A version that can't be read is left as None and the first error hit is recorded.
+    """
+    errors = []
+
+    def attempt(getter):
+        try:
+            return getter()
+        except Exception as e:
+            errors.append(str(e))
+            return None
+
+    boardname = try_get_boardname(chip)
+
+    # The versions are read as they are, without the ARC_STATE3 message that flashing sends to wake the ARC first
+    bundle_version = chip.get_bundle_version()
+    if bundle_version.exception is not None:
+        errors.append(str(bundle_version.exception))
+
+    return ChipStatus(
+        interface_id=chip.interface_id,
+        # i.e. Wormhole[0] -> Wormhole
+        chip=str(chip).split("[")[0],
+        board=None if boardname is None else change_to_public_name(boardname),
+        running_bundle_version=format_version(bundle_version.running),
+        spi_bundle_version=format_version(bundle_version.spi),
+        m3_app_fw_version=format_version(attempt(chip.m3_fw_app_version)),
+        arc_fw_version=format_version(attempt(chip.arc_l2_fw_version)),
+        smbus_fw_version=format_version(attempt(chip.smbus_fw_version)),
+        error=errors[0] if len(errors) > 0 else None,
+    )
+
+
+def get_fleet_status(chips: list[TTChip]) -> list[ChipStatus]:
+    """
+    @return the status of every chip, see map_chips.
+    """
+    return map_chips(get_chip_status, chips)
+
+
+def print_status(statuses: list[ChipStatus], as_json: bool = False):
+    if as_json:
+        print(json.dumps([asdict(status) for status in statuses], indent=2))
+        return
+
+    headers = [
+        "PCI",
+        "Chip",
+        "Board",
+        "Running Bundle",
+        "SPI Bundle",
+        "M3 App",
+        "ARC",
+        "SMBus",
+        "Error",
+    ]
+    rows = [
+        [
+            status.interface_id,
+            status.chip,
+            status.board,
+            status.running_bundle_version,
+            status.spi_bundle_version,
+            status.m3_app_fw_version,
+            status.arc_fw_version,
+            status.smbus_fw_version,
+            status.error,
+        ]
+        for status in statuses
+    ]
+    print(tabulate(rows, headers=headers, missingval="N/A"))
@@ -1,9 +1,12 @@
 # SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
 # SPDX-License-Identifier: Apache-2.0
 
+import io
 import os
+import threading
+from contextlib import contextmanager
 
-from typing import Callable, Type, TYPE_CHECKING
+from typing import Callable, Iterator, Type, TYPE_CHECKING
 
 from base64 import b16decode
 
@@ -91,6 +94,16 @@ def get_board_type(board_id: int, from_type: bool = False) -> Optional[str]:
         return None
 
 
+def try_get_boardname(chip: "TTChip") -> Optional[str]:
+    """
+    @return the board type of a chip, or None if it couldn't be read or isn't recognized.
+    """
+    try:
+        return get_board_type(chip.board_type(), from_type=True)
+    except Exception:
+        return None
+
+
 def change_to_public_name(codename: str) -> str:
     name_map = {
         "E300_105": "e150",
@@ -165,8 +178,65 @@ class CmdLineConfig:
         self.COLOR = ConfigurableCmdColor(use_color)
         self.force_no_tty = force_no_tty
 
+        # Worker threads can't share the terminal line, so they can disable the tty output for themselves
+        self.thread_state = threading.local()
+
     def is_tty(self) -> bool:
+        if getattr(self.thread_state, "force_no_tty", False):
+            return False
         return (not self.force_no_tty) and sys.stdout.isatty()
 
 
+class OutputRouter(io.TextIOBase):
+    """
+    Stand-in for sys.stdout which lets worker threads collect their output into a private buffer.
+    That way the output for each chip can be printed as one block instead of being interleaved
+    with the output of the other workers.
+    """
+
+    def __init__(self, stream) -> None:
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.thread_state = threading.local()
+
+    @contextmanager
+    def capture(self) -> Iterator[io.StringIO]:
+        buffer = io.StringIO()
+        self.thread_state.buffer = buffer
+        CConfig.thread_state.force_no_tty = True
+        try:
+            yield buffer
+        finally:
+            self.thread_state.buffer = None
+            CConfig.thread_state.force_no_tty = False
+
+    def write(self, s: str) -> int:
+        buffer = getattr(self.thread_state, "buffer", None)
+        if buffer is not None:
+            return buffer.write(s)
+
+        with self.lock:
+            return self.stream.write(s)
+
+    def flush(self) -> None:
+        with self.lock:
+            self.stream.flush()
+
+    def isatty(self) -> bool:
+        return self.stream.isatty()
+
+
+@contextmanager
+def route_output() -> Iterator[OutputRouter]:
+    """
+    Install an OutputRouter as sys.stdout for the duration of the context.
+    """
+    router = OutputRouter(sys.stdout)
+    sys.stdout = router
+    try:
+        yield router
+    finally:
+        sys.stdout = router.stream
+
+
 CConfig = CmdLineConfig(True, False)
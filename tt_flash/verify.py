@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: © 2024 Tenstorrent AI ULC
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from tabulate import tabulate
+
+from tt_flash.chip import TTChip, map_chips
+from tt_flash.error import TTError
+from tt_flash.flash import (
+    expected_digests,
+    load_image_template,
+    spi_digest,
+    verify_package,
+    volatile_regions,
+)
+from tt_flash.image import ImageTemplate
+from tt_flash.package import FwPackage
+from tt_flash.record import find_flash_record
+from tt_flash.utility import CConfig, change_to_public_name, try_get_boardname
+
+
+@dataclass
+class RegionResult:
+    start: int
+    end: int
+    matches: bool
+
+
+@dataclass
+class ChipVerifyResult:
+    chip: TTChip
+    board: Optional[str]
+    regions: list[RegionResult] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def matches(self) -> bool:
+        return self.error is None and all(region.matches for region in self.regions)
+
+
+def verify_chip(
+    chip: TTChip,
+    board: Optional[str],
+    template: Optional[ImageTemplate],
+    skip_missing_fw: bool = False,
+) -> ChipVerifyResult:
+    """
+    Compare the SPI of a chip against the image that flashing it would have written.
+
+    Each extent of the image is compared by streaming both it and the SPI through a hash,
+    the SPI is read back in bounded chunks so memory use doesn't depend on the size of the image.
+    The params which record when or by which tt-flash the chip was flashed are not compared.
+    """
+    result = ChipVerifyResult(chip=chip, board=board)
+    if template is None:
+        if not skip_missing_fw:
+            result.error = "Could not find flash data for this board in the fw package"
+        return result
+
+    try:
+        image = template.instantiate(chip)
+        for extent, regions, expected in expected_digests(
+            image, volatile_regions(template)
+        ):
+            result.regions.append(
+                RegionResult(
+                    start=extent.addr,
+                    end=extent.end,
+                    matches=spi_digest(chip, regions) == expected,
+                )
+            )
+    except Exception as e:
+        result.error = str(e)
+
+    return result
+
+
+def verify_chips(
+    devices: list[TTChip], fw_package: FwPackage, skip_missing_fw: bool = False
+) -> list[ChipVerifyResult]:
+    """
+    Verify the SPI of every chip against the fw package, see map_chips.
+
+    @return the result for each chip, in the same order as devices
+    """
+    verify_package(fw_package)
+
+    # The image for each board type is only prepared once, then filled in for each chip
+    templates: dict[str, Optional[ImageTemplate]] = {}
+    boards = []
+    for chip in devices:
+        boardname = try_get_boardname(chip)
+
+        if boardname is None:
+            raise TTError(f"Did not recognize board type for {chip}")
+
+        if boardname not in templates:
+            templates[boardname] = load_image_template(
+                chip, boardname, fw_package, skip_missing_fw=True
+            )
+        boards.append(boardname)
+
+    def worker(chip: TTChip, boardname: str) -> ChipVerifyResult:
+        return verify_chip(
+            chip,
+            change_to_public_name(boardname),
+            templates[boardname],
+            skip_missing_fw=skip_missing_fw,
+        )
+
+    return map_chips(lambda job: worker(*job), list(zip(devices, boards)))
+
+
+def verify_chip_record(chip: TTChip, state_dirs: list[Path]) -> ChipVerifyResult:
+    """
+    Compare the SPI of a chip against the hashes in the record of its last flash.
+    """
+    boardname = try_get_boardname(chip)
+
+    result = ChipVerifyResult(
+        chip=chip,
+        board=None if boardname is None else change_to_public_name(boardname),
+    )
+    try:
+        _, record = find_flash_record(chip, state_dirs)
+        result.board = change_to_public_name(record["boardname"])
+        for extent in record["extents"]:
+            start = extent["addr"]
+            end = start + extent["size"]
+            result.regions.append(
+                RegionResult(
+                    start=start,
+                    end=end,
+                    matches=spi_digest(chip, [(start, end)]) == extent["sha256"],
+                )
+            )
+    except Exception as e:
+        result.error = str(e)
+
+    return result
+
+
+def verify_chips_with_records(
+    devices: list[TTChip], state_dirs: list[Path]
+) -> list[ChipVerifyResult]:
+    """
+    Verify the SPI of every chip against its flash record, see map_chips.
+
+    @return the result for each chip, in the same order as devices
+    """
+    return map_chips(lambda chip: verify_chip_record(chip, state_dirs), devices)
+
+
+def print_verify_results(results: list[ChipVerifyResult]):
+    def result_str(matches: bool) -> str:
+        if matches:
+            return f"{CConfig.COLOR.GREEN}PASS{CConfig.COLOR.ENDC}"
+        else:
+            return f"{CConfig.COLOR.RED}FAIL{CConfig.COLOR.ENDC}"
+
+    rows = []
+    for result in results:
+        for region in result.regions:
+            rows.append(
+                [
+                    str(result.chip),
+                    result.board,
+                    f"{region.start:#x}-{region.end:#x}",
+                    region.end - region.start,
+                    result_str(region.matches),
+                ]
+            )
+    print(tabulate(rows, headers=["Chip", "Board", "Region", "Size", "Result"]))
+
+    print()
+    for result in results:
+        line = f"{result.chip} {{{result.board}}}: {result_str(result.matches)}"
+        if result.error is not None:
+            line += f" - {result.error}"
+        print(line)